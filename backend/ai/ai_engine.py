@@ -1,11 +1,10 @@
-engine:-
-
+import os
 import torch
 import numpy as np
 import cv2
 from PIL import Image
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
 # ================================================================
 # LOAD TrOCR MODEL (LAZY LOADING)
@@ -16,29 +15,329 @@ MODEL_NAME = "microsoft/trocr-small-handwritten"
 processor = None
 model = None
 device = None
+_feat_transform = None  # Cached Resize+ToTensor+Normalize, built in _load_model
+
+# Optional accelerated backend: "eager" (default) or "onnx".
+# With TROCR_BACKEND=onnx the model is exported to ONNX via optimum and run
+# through onnxruntime, using the TensorRT EP with FP16 when a GPU is present.
+TROCR_BACKEND = os.getenv("TROCR_BACKEND", "eager").lower()
+ONNX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "trocr-onnx")
+
+
+def _load_onnx_model():
+    """Try to load the ONNX-exported TrOCR model (TensorRT/CUDA EP + FP16 on GPU)."""
+    from optimum.onnxruntime import ORTModelForVision2Seq
+
+    def _load(provider, provider_options=None):
+        # optimum takes one provider name plus its options dict - not the
+        # onnxruntime-style list of (name, options) tuples
+        return ORTModelForVision2Seq.from_pretrained(
+            MODEL_NAME,
+            export=True,
+            cache_dir=ONNX_CACHE_DIR,
+            provider=provider,
+            provider_options=provider_options,
+        )
+
+    if torch.cuda.is_available():
+        # TensorRT EP fuses attention kernels and uses tensor cores via FP16;
+        # fall back to the CUDA EP if TensorRT isn't installed.
+        try:
+            return _load("TensorrtExecutionProvider", {
+                "trt_fp16_enable": True,
+                "trt_engine_cache_enable": True,
+                "trt_engine_cache_path": ONNX_CACHE_DIR,
+            })
+        except Exception as e:
+            print(f"⚠️ TensorRT EP unavailable, trying CUDA EP: {e}")
+        try:
+            return _load("CUDAExecutionProvider")
+        except Exception as e:
+            print(f"⚠️ CUDA EP unavailable, using CPU EP: {e}")
+
+    return _load("CPUExecutionProvider")
+
+
+def _make_skip_finished_class(base_cls):
+    """Build a VisionEncoderDecoderModel subclass that skips finished rows.
+
+    When lines of different lengths are decoded in one batch, HF generate
+    keeps running the decoder for rows that already emitted EOS. Slicing
+    each step down to the still-active rows cuts decoder FLOPs roughly in
+    proportion to (max length / mean length). Any failure falls back to
+    the stock forward for that step.
+    """
+
+    class SkipFinishedModel(base_cls):
+
+        def forward(self, pixel_values=None, decoder_input_ids=None, **kwargs):
+            past = kwargs.get("past_key_values")
+            if (self.training or past is None or decoder_input_ids is None
+                    or decoder_input_ids.shape[0] <= 1):
+                return super().forward(
+                    pixel_values=pixel_values,
+                    decoder_input_ids=decoder_input_ids,
+                    **kwargs
+                )
+
+            try:
+                eos_id = self.config.decoder.eos_token_id
+                pad_id = self.config.decoder.pad_token_id
+                last = decoder_input_ids[:, -1]
+                active = ~((last == eos_id) | (last == pad_id))
+
+                if bool(active.all()) or not bool(active.any()):
+                    return super().forward(
+                        pixel_values=pixel_values,
+                        decoder_input_ids=decoder_input_ids,
+                        **kwargs
+                    )
+
+                active_idx = active.nonzero(as_tuple=True)[0]
+                sub_kwargs = dict(kwargs)
+                sub_kwargs["past_key_values"] = tuple(
+                    tuple(t.index_select(0, active_idx) for t in layer)
+                    for layer in past
+                )
+                for key in ("encoder_outputs", "attention_mask", "decoder_attention_mask"):
+                    val = sub_kwargs.get(key)
+                    if isinstance(val, torch.Tensor):
+                        sub_kwargs[key] = val.index_select(0, active_idx)
+                    elif key == "encoder_outputs" and val is not None:
+                        hidden = val[0].index_select(0, active_idx)
+                        sub_kwargs[key] = type(val)(hidden) if hasattr(val, "_fields") else (hidden,)
+
+                out = super().forward(
+                    pixel_values=None,
+                    decoder_input_ids=decoder_input_ids.index_select(0, active_idx),
+                    **sub_kwargs
+                )
+
+                # Scatter logits back to full batch; finished rows keep
+                # emitting pad so generate() leaves them untouched.
+                batch = decoder_input_ids.shape[0]
+                logits = out.logits.new_zeros((batch,) + out.logits.shape[1:])
+                logits[:, :, pad_id] = 1.0
+                logits[active_idx] = out.logits
+                out.logits = logits
+
+                if out.past_key_values is not None:
+                    full_past = []
+                    for layer_new, layer_old in zip(out.past_key_values, past):
+                        layer = []
+                        for t_new, t_old in zip(layer_new, layer_old):
+                            if t_new.shape[-2] == t_old.shape[-2]:
+                                # Cross-attention cache: unchanged length
+                                full = t_old
+                            else:
+                                full = t_new.new_zeros((batch,) + t_new.shape[1:])
+                                full[:, :, :t_old.shape[-2]] = t_old
+                                full[active_idx] = t_new
+                            layer.append(full)
+                        full_past.append(tuple(layer))
+                    out.past_key_values = tuple(full_past)
+
+                return out
+            except Exception:
+                return super().forward(
+                    pixel_values=pixel_values,
+                    decoder_input_ids=decoder_input_ids,
+                    **kwargs
+                )
+
+    return SkipFinishedModel
+
 
 def _load_model():
     """Load TrOCR model lazily (only when first needed)."""
     global processor, model, device
-    
+
     if model is not None:
         return  # Already loaded
-    
+
     print("📥 Loading TrOCR model (this may take a moment)...")
     from transformers import TrOCRProcessor, VisionEncoderDecoderModel
-    
+
     processor = TrOCRProcessor.from_pretrained(MODEL_NAME)
-    model = VisionEncoderDecoderModel.from_pretrained(MODEL_NAME)
-    
+    _build_feat_transform()
+
     device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    if TROCR_BACKEND == "onnx":
+        try:
+            model = _load_onnx_model()
+            print("✅ TrOCR ONNX model loaded (onnxruntime)")
+            return
+        except Exception as e:
+            print(f"⚠️ ONNX backend unavailable, falling back to PyTorch: {e}")
+
+    # Skip-finished defaults to on only when torch.compile is off: its
+    # data-dependent branches (nonzero, per-step any/all, try/except) can't
+    # be captured in one Dynamo graph, and it assumes legacy tuple KV
+    # caches while compile switches to a static cache - combined, the
+    # first multi-line page would raise out of generate(). The batch=1
+    # compile warm-up takes the early-return path, so the rollback there
+    # can't catch it. TROCR_SKIP_FINISHED overrides either way.
+    compile_on = os.getenv("TROCR_COMPILE", "true").lower() == "true"
+    default_skip = "false" if compile_on else "true"
+    if os.getenv("TROCR_SKIP_FINISHED", default_skip).lower() == "true":
+        model_cls = _make_skip_finished_class(VisionEncoderDecoderModel)
+    else:
+        model_cls = VisionEncoderDecoderModel
+
+    quantize = os.getenv("TROCR_QUANTIZE", "false").lower() == "true"
+
+    if quantize and device == "cuda":
+        # int8 weights via bitsandbytes: the decoder re-reads its weights
+        # every autoregressive step, so weight bandwidth is the bottleneck
+        try:
+            from transformers import BitsAndBytesConfig
+            model = model_cls.from_pretrained(
+                MODEL_NAME,
+                quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+            )
+            model.eval()
+            print("✅ TrOCR loaded with int8 weights (bitsandbytes)")
+            return
+        except Exception as e:
+            print(f"⚠️ int8 quantization unavailable, loading full precision: {e}")
+
+    model = model_cls.from_pretrained(MODEL_NAME)
     model.to(device)
     model.eval()
+
+    if quantize and device == "cpu":
+        # Dynamic int8 quantization of the decoder's linear layers for
+        # VNNI-capable CPUs; encoder stays FP32 (single pass per image)
+        try:
+            import torch.nn as nn
+            model.decoder = torch.ao.quantization.quantize_dynamic(
+                model.decoder, {nn.Linear}, dtype=torch.qint8
+            )
+            print("✅ TrOCR decoder dynamically quantized to int8")
+        except Exception as e:
+            print(f"⚠️ Dynamic quantization failed, keeping FP32 decoder: {e}")
+
+    if device == "cuda":
+        # Fixed 384x384 ViT input: let cuDNN autotune kernels once and use
+        # tensor-core-friendly matmuls + NHWC layout for the encoder
+        torch.backends.cudnn.benchmark = True
+        torch.set_float32_matmul_precision("high")
+        model.encoder = model.encoder.to(memory_format=torch.channels_last)
+
+    _trace_encoder()
+    _compile_model()
     print("✅ TrOCR model loaded successfully!")
 
+
+def _trace_encoder():
+    """Trace the fixed-shape ViT encoder to a frozen TorchScript module.
+
+    The encoder always sees 384x384 inputs, so one trace turns its Python
+    forward into a single fused graph invocation. Defaults to on only
+    when torch.compile is disabled (the two would compile the encoder
+    twice); TROCR_JIT_ENCODER overrides either way.
+    """
+    global model
+
+    compile_on = os.getenv("TROCR_COMPILE", "true").lower() == "true"
+    default = "false" if compile_on else "true"
+    if os.getenv("TROCR_JIT_ENCODER", default).lower() != "true":
+        return
+
+    from transformers.modeling_outputs import BaseModelOutput
+
+    class _TracedEncoder(torch.nn.Module):
+        """Adapter so generate() can call the traced graph like the eager
+        encoder: accepts the HF kwargs (return_dict etc.), ignores them,
+        and re-wraps the raw graph output as a BaseModelOutput."""
+
+        def __init__(self, traced, config):
+            super().__init__()
+            self.traced = traced
+            self.config = config
+
+        def forward(self, pixel_values=None, **kwargs):
+            out = self.traced(pixel_values)
+            if isinstance(out, dict):
+                out = out.get("last_hidden_state", next(iter(out.values())))
+            elif isinstance(out, (tuple, list)):
+                out = out[0]
+            return BaseModelOutput(last_hidden_state=out)
+
+    original_encoder = model.encoder
+    try:
+        example = torch.zeros(1, 3, 384, 384, device=device)
+        traced = torch.jit.freeze(torch.jit.trace(original_encoder, example, strict=False))
+        model.encoder = _TracedEncoder(traced, original_encoder.config)
+
+        # Trace success alone doesn't prove generate() accepts the swap -
+        # exercise the full decode path before committing to it
+        with torch.no_grad():
+            model.generate(example, max_new_tokens=2)
+        print("⚡ TrOCR encoder traced to TorchScript")
+    except Exception as e:
+        model.encoder = original_encoder
+        print(f"⚠️ Encoder tracing failed, keeping eager encoder: {e}")
+
+
+def _compile_model():
+    """Speed up decoding with torch.compile + a static KV cache.
+
+    A static cache avoids re-allocating key/value tensors every decode
+    step and lets Inductor fuse the attention/MLP kernels. Compilation
+    cost is paid once here via a dummy warm-up pass. Requires torch>=2.1;
+    silently keeps the eager model otherwise.
+    """
+    global model
+
+    if os.getenv("TROCR_COMPILE", "true").lower() != "true":
+        return
+
+    # Keep the pre-compile state so a failed warm-up can roll back fully;
+    # otherwise model.forward stays bound to the broken compiled wrapper
+    # and every later generate() re-raises the same error
+    original_forward = model.forward
+    original_cache_impl = getattr(model.generation_config, "cache_implementation", None)
+    original_max_length = model.generation_config.max_length
+
+    try:
+        model.generation_config.cache_implementation = "static"
+        model.generation_config.max_length = 96
+        model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=True)
+
+        # Warm up so the first real page doesn't pay the compile cost
+        dummy = torch.zeros((1, 3, 384, 384), device=device)
+        with torch.no_grad():
+            model.generate(dummy, max_new_tokens=4)
+        print("⚡ TrOCR decoder compiled (static KV cache)")
+    except Exception as e:
+        model.forward = original_forward
+        model.generation_config.cache_implementation = original_cache_impl
+        model.generation_config.max_length = original_max_length
+        print(f"⚠️ torch.compile unavailable, using eager decoder: {e}")
+
 # ================================================================
 # IMPROVED OCR UTILITIES
 # ================================================================
 
+# Route OpenCV filters through the T-API (OpenCL) when a device is
+# available: UMat inputs offload the memory-bound filter chain to the
+# integrated/discrete GPU and avoid per-step numpy roundtrips
+try:
+    _USE_OPENCL = cv2.ocl.haveOpenCL() and os.getenv("TROCR_OPENCL", "true").lower() == "true"
+except Exception:
+    _USE_OPENCL = False
+
+# Reusable preprocessing constants - rebuilt per line before, which for a
+# 50-line page meant 50 identical allocations
+_CLAHE = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+_SHARPEN_KERNEL = np.array([[-1, -1, -1],
+                            [-1,  9, -1],
+                            [-1, -1, -1]], dtype=np.float32)
+_NOISE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
+
+
 def adaptive_binarization(gray_image: np.ndarray) -> np.ndarray:
     """Better binarization using adaptive thresholding"""
     # Apply adaptive thresholding for better handling of varying lighting
@@ -52,8 +351,7 @@ def adaptive_binarization(gray_image: np.ndarray) -> np.ndarray:
 def remove_noise(binary_image: np.ndarray) -> np.ndarray:
     """Remove small noise components"""
     # Morphological opening to remove noise
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
-    cleaned = cv2.morphologyEx(binary_image, cv2.MORPH_OPEN, kernel)
+    cleaned = cv2.morphologyEx(binary_image, cv2.MORPH_OPEN, _NOISE_KERNEL)
     return cleaned
 
 
@@ -61,30 +359,35 @@ def detect_skew(gray_image: np.ndarray) -> float:
     """Detect skew angle of the document"""
     # Binarize
     _, binary = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-    
-    # Find coordinates of all white pixels
-    coords = np.column_stack(np.where(binary > 0))
-    
-    # Fit a minimum area rectangle
-    if len(coords) > 0:
-        rect = cv2.minAreaRect(coords)
-        angle = rect[-1]
-        
-        # Normalize angle
-        if angle < -45:
-            angle = 90 + angle
-        elif angle > 45:
-            angle = angle - 90
-            
-        return angle
-    return 0
 
+    # Estimate the text orientation from central image moments instead of
+    # materializing every foreground coordinate for minAreaRect - this is
+    # a single C pass with no per-pixel allocation
+    m = cv2.moments(binary, binaryImage=True)
+    if m["m00"] == 0:
+        return 0
 
-def deskew_image(image: Image.Image) -> Image.Image:
-    """Correct skew/rotation in the image"""
+    angle = 0.5 * np.arctan2(2 * m["mu11"], m["mu20"] - m["mu02"]) * 180 / np.pi
+
+    # Normalize angle
+    if angle < -45:
+        angle = 90 + angle
+    elif angle > 45:
+        angle = angle - 90
+
+    return angle
+
+
+def _deskew_with_gray(image: Image.Image) -> Tuple[Image.Image, np.ndarray]:
+    """Deskew and return both the color image and its grayscale array.
+
+    The grayscale page is needed again by segmentation and per-line
+    preprocessing; converting once here (and rotating it alongside the
+    color image) avoids re-running the conversion per stage and per line.
+    """
     gray = np.array(image.convert("L"))
     angle = detect_skew(gray)
-    
+
     # Only deskew if angle is significant
     if abs(angle) > 0.5:
         (h, w) = gray.shape
@@ -95,116 +398,289 @@ def deskew_image(image: Image.Image) -> Image.Image:
             flags=cv2.INTER_CUBIC,
             borderMode=cv2.BORDER_REPLICATE
         )
-        return Image.fromarray(rotated)
-    
-    return image
+        gray = cv2.warpAffine(
+            gray, M, (w, h),
+            flags=cv2.INTER_CUBIC,
+            borderMode=cv2.BORDER_REPLICATE
+        )
+        return Image.fromarray(rotated), gray
 
+    return image, gray
 
-def segment_lines_improved(pil_image: Image.Image) -> List[Tuple[Image.Image, int]]:
-    """Improved line segmentation with better filtering"""
-    gray = np.array(pil_image.convert("L"))
-    
-    # Adaptive binarization
-    binary = adaptive_binarization(gray)
-    
-    # Remove noise
-    cleaned = remove_noise(binary)
-    
-    # Horizontal projection profile
-    horizontal_projection = np.sum(cleaned, axis=1)
+
+def deskew_image(image: Image.Image) -> Image.Image:
+    """Correct skew/rotation in the image"""
+    return _deskew_with_gray(image)[0]
+
+
+def segment_lines_improved(pil_image: Image.Image, gray: np.ndarray = None) -> List[Tuple[np.ndarray, int]]:
+    """Improved line segmentation with better filtering.
+
+    Returns grayscale line crops (zero-copy slices of the page array)
+    with their y positions. Pass the page's grayscale array if already
+    computed to skip a redundant conversion.
+    """
+    if gray is None:
+        gray = np.array(pil_image.convert("L"))
+
+    # Binarize + denoise + row projection, on the OpenCL device when one
+    # is available (the whole chain stays in a UMat until the reduce)
+    if _USE_OPENCL:
+        u = cv2.UMat(gray)
+        cleaned = remove_noise(adaptive_binarization(u))
+        horizontal_projection = cv2.reduce(
+            cleaned, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S
+        ).get().ravel()
+    else:
+        # Adaptive binarization
+        binary = adaptive_binarization(gray)
+
+        # Remove noise
+        cleaned = remove_noise(binary)
+
+        # Horizontal projection profile
+        horizontal_projection = np.sum(cleaned, axis=1)
     
-    # Find line boundaries using projection profile
+    # Find line boundaries using projection profile (vectorized run
+    # detection: diff of the thresholded mask gives run starts/ends in C
+    # instead of a Python loop over every image row)
     threshold = np.max(horizontal_projection) * 0.1
-    in_line = False
-    line_boundaries = []
-    start = 0
-    
-    for i, val in enumerate(horizontal_projection):
-        if val > threshold and not in_line:
-            start = i
-            in_line = True
-        elif val <= threshold and in_line:
-            if i - start > 10:  # Minimum line height
-                line_boundaries.append((start, i))
-            in_line = False
-    
-    # If still in a line at the end
-    if in_line and len(horizontal_projection) - start > 10:
-        line_boundaries.append((start, len(horizontal_projection)))
+    mask = horizontal_projection > threshold
+    edges = np.diff(mask.astype(np.int8), prepend=0, append=0)
+    starts = np.where(edges == 1)[0]
+    ends = np.where(edges == -1)[0]
+
+    # Minimum line height filter
+    keep = (ends - starts) > 10
+    line_boundaries = list(zip(starts[keep], ends[keep]))
     
-    # Extract line images with padding
+    # Extract grayscale line crops with padding (array slices, no copy)
+    page_height = gray.shape[0]
     lines = []
     for start, end in line_boundaries:
         padding = 10
         y1 = max(0, start - padding)
-        y2 = min(pil_image.height, end + padding)
-        
-        cropped = pil_image.crop((0, y1, pil_image.width, y2))
-        
+        y2 = min(page_height, end + padding)
+
         # Filter out very small or very large lines
-        if cropped.height > 15 and cropped.height < pil_image.height * 0.5:
-            lines.append((cropped, start))  # Keep y-position for ordering
-    
+        if (y2 - y1) > 15 and (y2 - y1) < page_height * 0.5:
+            lines.append((gray[y1:y2], start))  # Keep y-position for ordering
+
     return lines
 
 
-def preprocess_for_trocr_improved(img: Image.Image) -> Image.Image:
-    """Enhanced preprocessing for better OCR accuracy"""
-    # Convert to grayscale
-    gray = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2GRAY)
-    
+def preprocess_for_trocr_improved(img, strong_denoise: bool = False) -> Image.Image:
+    """Enhanced preprocessing for better OCR accuracy.
+
+    Accepts either a PIL image or an already-grayscale numpy array (the
+    segmentation step hands over gray crops directly).
+    """
+    if isinstance(img, Image.Image):
+        gray = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2GRAY)
+    else:
+        gray = img
+
     # Resize if too small (TrOCR works better with certain sizes)
     h, w = gray.shape
     if h < 32:
         scale = 32 / h
         new_h, new_w = int(h * scale), int(w * scale)
         gray = cv2.resize(gray, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
-    
-    # Denoise with optimized parameters
-    denoised = cv2.fastNlMeansDenoising(gray, None, h=20, templateWindowSize=7, searchWindowSize=21)
-    
+
+    # Denoise: bilateral filter keeps edges sharp and is orders of magnitude
+    # cheaper than non-local means, which dominated per-line CPU time.
+    # strong_denoise retains the old behavior for pathologically noisy scans.
+    if strong_denoise:
+        denoised = cv2.fastNlMeansDenoising(gray, None, h=20, templateWindowSize=7, searchWindowSize=21)
+    else:
+        # UMat keeps the filter chain on the OpenCL device until the
+        # final download back to numpy
+        src = cv2.UMat(gray) if _USE_OPENCL else gray
+        denoised = cv2.bilateralFilter(src, d=5, sigmaColor=30, sigmaSpace=7)
+
     # CLAHE for contrast enhancement
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-    enhanced = clahe.apply(denoised)
-    
+    enhanced = _CLAHE.apply(denoised)
+
     # Sharpen the image
-    kernel_sharpen = np.array([[-1,-1,-1],
-                               [-1, 9,-1],
-                               [-1,-1,-1]])
-    sharpened = cv2.filter2D(enhanced, -1, kernel_sharpen)
-    
+    sharpened = cv2.filter2D(enhanced, -1, _SHARPEN_KERNEL)
+
     # Normalize brightness and contrast
     normalized = cv2.normalize(sharpened, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
-    
+    if isinstance(normalized, cv2.UMat):
+        normalized = normalized.get()
+
     return Image.fromarray(normalized).convert("RGB")
 
 
-def ocr_line_with_confidence(img: Image.Image) -> Tuple[str, float]:
-    """OCR with confidence score estimation"""
+def _build_feat_transform():
+    """Build the image-to-tensor transform once instead of per line.
+
+    TrOCRProcessor.__call__ re-runs PIL resize + normalize in Python per
+    image; the target size and mean/std are fixed, so a precomputed
+    torchvision Compose does the same work with far less overhead.
+    """
+    global _feat_transform
+    try:
+        import torchvision.transforms as T
+        ip = processor.image_processor
+        size = (ip.size["height"], ip.size["width"])
+        _feat_transform = T.Compose([
+            T.Resize(size, antialias=True),
+            T.ToTensor(),
+            T.Normalize(mean=ip.image_mean, std=ip.image_std),
+        ])
+    except Exception as e:
+        print(f"⚠️ Falling back to TrOCRProcessor preprocessing: {e}")
+        _feat_transform = None
+
+
+def _pixel_values(imgs: List[Image.Image]) -> "torch.Tensor":
+    """Convert line images to a pixel_values batch on the target device.
+
+    On CUDA the host batch is staged in pinned memory and copied
+    asynchronously: DMA from page-locked memory roughly doubles PCIe
+    bandwidth and the copy overlaps with preprocessing of the next batch.
+    """
+    if _feat_transform is not None:
+        batch = torch.stack([_feat_transform(img) for img in imgs])
+    else:
+        batch = processor(images=imgs, return_tensors="pt").pixel_values
+
+    if device == "cuda":
+        return batch.pin_memory().to(device, non_blocking=True)
+    return batch.to(device)
+
+
+def _gpu_preprocess_available() -> bool:
+    """GPU preprocessing needs CUDA plus kornia installed."""
+    if not torch.cuda.is_available():
+        return False
+    try:
+        import kornia  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def preprocess_for_trocr_gpu(img) -> Image.Image:
+    """Kornia/CUDA port of preprocess_for_trocr_improved.
+
+    Keeps the line crop in a single CUDA tensor for the blur, CLAHE,
+    sharpen and normalize steps instead of running four OpenCV passes on
+    the CPU per line. Output matches the CPU path closely enough for the
+    TrOCR processor.
+    """
+    import kornia
+
+    if isinstance(img, Image.Image):
+        gray = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2GRAY)
+    else:
+        gray = img
+
+    h, w = gray.shape
+    if h < 32:
+        scale = 32 / h
+        gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_CUBIC)
+
+    t = torch.from_numpy(gray).float().div_(255.0)[None, None].to(device)
+
+    # Denoise (mild) + contrast enhancement + sharpen, all on device
+    t = kornia.filters.gaussian_blur2d(t, (5, 5), (1.2, 1.2))
+    t = kornia.enhance.equalize_clahe(t, clip_limit=3.0, grid_size=(8, 8))
+    sharpen = torch.tensor([[[-1., -1., -1.],
+                             [-1.,  9., -1.],
+                             [-1., -1., -1.]]], device=t.device)
+    t = kornia.filters.filter2d(t, sharpen)
+
+    # Min-max normalize to full range
+    t_min, t_max = t.min(), t.max()
+    if float(t_max - t_min) > 0:
+        t = (t - t_min) / (t_max - t_min)
+
+    out = (t.clamp_(0, 1) * 255).byte().squeeze().cpu().numpy()
+    return Image.fromarray(out).convert("RGB")
+
+
+def ocr_lines_with_confidence(imgs: List[Image.Image], batch_size: int = 8,
+                              num_beams: int = 1) -> List[Tuple[str, float]]:
+    """Batched OCR over multiple line images with confidence scores.
+
+    Running all lines through a single generate() call amortizes the
+    per-call preprocessing and kernel launch overhead, which dominates
+    when pages have many short lines. batch_size chunks the work so we
+    don't blow VRAM on pages with lots of lines.
+
+    Decoding is greedy by default: beam search multiplies decoder weight
+    reads by the beam count for little gain on short single lines. Pass
+    num_beams=5 for a high-quality mode.
+    """
     _load_model()  # Ensure model is loaded
-    
-    inputs = processor(images=img, return_tensors="pt").pixel_values.to(device)
-    
-    # Generate with beam search for better results
-    with torch.no_grad():
-        outputs = model.generate(
-            inputs,
-            max_new_tokens=80,
-            num_beams=5,  # Beam search for better quality
-            early_stopping=True,
-            output_scores=True,
-            return_dict_in_generate=True
-        )
-    
-    ids = outputs.sequences
-    text = processor.batch_decode(ids, skip_special_tokens=True)[0].strip()
-    
-    # Estimate confidence from sequence scores if available
-    confidence = 1.0
-    if hasattr(outputs, 'sequences_scores'):
-        confidence = float(torch.exp(outputs.sequences_scores[0]))
-    
-    return text, confidence
+
+    if not imgs:
+        return []
+
+    gen_kwargs = dict(
+        max_new_tokens=80,
+        output_scores=True,
+        return_dict_in_generate=True,
+    )
+    if num_beams > 1:
+        gen_kwargs.update(num_beams=num_beams, early_stopping=True)
+    else:
+        gen_kwargs.update(do_sample=False, no_repeat_ngram_size=3, repetition_penalty=1.1)
+
+    results = []
+    for i in range(0, len(imgs), batch_size):
+        chunk = imgs[i:i + batch_size]
+        inputs = _pixel_values(chunk)
+
+        # FP16 autocast + channels_last on CUDA for tensor-core matmuls
+        with torch.no_grad():
+            if device == "cuda":
+                inputs = inputs.to(memory_format=torch.channels_last)
+                with torch.autocast("cuda", dtype=torch.float16):
+                    outputs = model.generate(inputs, **gen_kwargs)
+            else:
+                outputs = model.generate(inputs, **gen_kwargs)
+
+        texts = processor.batch_decode(outputs.sequences, skip_special_tokens=True)
+
+        # Per-line confidence: beam search exposes sequences_scores; for
+        # greedy decoding approximate with the mean chosen-token log-prob
+        scores = getattr(outputs, 'sequences_scores', None)
+        if scores is None and outputs.scores:
+            step_logprobs = torch.stack(
+                [torch.log_softmax(s.float(), dim=-1).max(dim=-1).values for s in outputs.scores],
+                dim=1
+            )
+
+            # Average only the steps before each row's first EOS/pad: in a
+            # mixed-length batch the finished rows keep emitting pad logits
+            # (near-uniform with the skip-finished forward), which would
+            # drag a short line's score toward zero depending on how long
+            # its batchmates run
+            dec_cfg = getattr(model.config, "decoder", model.config)
+            generated = outputs.sequences[:, -step_logprobs.shape[1]:]
+            finished = torch.zeros_like(generated, dtype=torch.bool)
+            for stop_id in (dec_cfg.eos_token_id, dec_cfg.pad_token_id):
+                if stop_id is not None:
+                    finished |= generated == stop_id
+            alive = (~finished).long().cumprod(dim=1).bool()
+            alive[:, 0] = True  # a line that ends immediately still scores its one step
+            scores = (step_logprobs * alive).sum(dim=1) / alive.sum(dim=1)
+
+        for j, text in enumerate(texts):
+            confidence = 1.0
+            if scores is not None:
+                confidence = float(torch.exp(scores[j]))
+            results.append((text.strip(), confidence))
+
+    return results
+
+
+def ocr_line_with_confidence(img: Image.Image) -> Tuple[str, float]:
+    """OCR a single line with confidence score (backwards compatible)."""
+    return ocr_lines_with_confidence([img])[0]
 
 
 def merge_broken_lines(lines: List[str]) -> List[str]:
@@ -212,78 +688,96 @@ def merge_broken_lines(lines: List[str]) -> List[str]:
     if not lines:
         return lines
     
+    # Record group boundaries in one pass, then join each group once -
+    # avoids the quadratic `current += " " + line` string rebuilding
     merged = []
-    current = lines[0]
-    
+    start = 0
+
     for i in range(1, len(lines)):
-        # If current line doesn't end with punctuation and next line doesn't start with capital
-        if (current and not current[-1] in '.!?:;,' and 
-            lines[i] and len(lines[i]) > 0 and 
-            lines[i][0].islower()):
-            current += " " + lines[i]
-        else:
-            merged.append(current)
-            current = lines[i]
-    
-    merged.append(current)
+        prev = lines[i - 1]
+        # Merge if the previous line doesn't end with punctuation and this
+        # line doesn't start with a capital
+        if prev and prev[-1] not in '.!?:;,' and lines[i] and lines[i][0].islower():
+            continue
+        merged.append(" ".join(lines[start:i]))
+        start = i
+
+    merged.append(" ".join(lines[start:]))
     return merged
 
 
-def ocr_page_improved(pil_image: Image.Image, min_confidence: float = 0.3) -> dict:
+def ocr_page_improved(pil_image: Image.Image, min_confidence: float = 0.3,
+                      batch_size: int = 8) -> dict:
     """
     Improved OCR with preprocessing and confidence filtering
-    
+
     Args:
         pil_image: Input PIL Image
         min_confidence: Minimum confidence threshold (0-1)
-    
+        batch_size: Lines decoded per generate() call (VRAM/latency knob)
+
     Returns:
         Dictionary with 'lines', 'full_text', and 'metadata'
     """
-    # Step 1: Deskew the image
-    deskewed = deskew_image(pil_image)
-    
-    # Step 2: Segment lines with improved algorithm
-    line_data = segment_lines_improved(deskewed)
-    
-    # Step 3: Process each line
-    results = []
-    low_confidence_lines = []
-    
-    for line_img, y_pos in line_data:
-        # Preprocess
-        processed = preprocess_for_trocr_improved(line_img)
-        
-        # OCR with confidence
-        text, confidence = ocr_line_with_confidence(processed)
-        
+    # Step 1: Deskew the image (grayscale page computed once here)
+    deskewed, gray = _deskew_with_gray(pil_image)
+
+    # Step 2: Segment lines with improved algorithm, reusing the page gray
+    line_data = segment_lines_improved(deskewed, gray=gray)
+    
+    # Step 3: Preprocess and OCR in a double-buffered stream - batch k+1
+    # is preprocessed on a worker thread while the model decodes batch k,
+    # so CPU filtering hides behind GPU autoregression (and vice versa)
+    _load_model()  # Ensures device is set before preprocessing
+    if _gpu_preprocess_available():
+        preprocess = preprocess_for_trocr_gpu
+    else:
+        preprocess = preprocess_for_trocr_improved
+
+    chunks = [line_data[i:i + batch_size] for i in range(0, len(line_data), batch_size)]
+
+    ocr_results = []
+    if chunks:
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(lambda c: [preprocess(img) for img, _ in c], chunks[0])
+            for k in range(len(chunks)):
+                processed_imgs = future.result()
+                if k + 1 < len(chunks):
+                    future = pool.submit(lambda c: [preprocess(img) for img, _ in c], chunks[k + 1])
+                ocr_results.extend(ocr_lines_with_confidence(processed_imgs, batch_size=batch_size))
+
+    # Structure-of-arrays aggregation: parallel texts/confs/ys lists so
+    # sorting and averaging happen on contiguous NumPy arrays instead of
+    # hashing per-line dicts and sorting with a lambda key
+    texts = []
+    confs = []
+    ys = []
+    low_confidence_count = 0
+
+    for (text, confidence), (_, y_pos) in zip(ocr_results, line_data):
         if text:
-            results.append({
-                'text': text,
-                'confidence': confidence,
-                'y_position': y_pos
-            })
-            
+            texts.append(text)
+            confs.append(confidence)
+            ys.append(y_pos)
+
             if confidence < min_confidence:
-                low_confidence_lines.append(text)
-    
+                low_confidence_count += 1
+
     # Sort by y-position to maintain reading order
-    results.sort(key=lambda x: x['y_position'])
-    
-    # Extract just the text
-    text_lines = [r['text'] for r in results]
-    
+    order = np.argsort(np.asarray(ys)) if ys else []
+    text_lines = [texts[i] for i in order]
+
     # Optional: merge broken lines
     merged_lines = merge_broken_lines(text_lines)
-    
+
     return {
         'lines': merged_lines,
         'full_text': '\n'.join(merged_lines),
         'raw_lines': text_lines,
         'metadata': {
-            'total_lines': len(results),
-            'avg_confidence': np.mean([r['confidence'] for r in results]) if results else 0,
-            'low_confidence_count': len(low_confidence_lines)
+            'total_lines': len(texts),
+            'avg_confidence': float(np.asarray(confs).mean()) if confs else 0,
+            'low_confidence_count': low_confidence_count
         }
     }
 
@@ -1,76 +1,704 @@
-groq_service.py:-
-
 """
 Groq API Service for Medical Document Key-Value Extraction
 Uses Groq's Qwen model to intelligently extract key-value pairs from OCR text.
 """
 import os
+import re
 import json
+import time
+import random
+import asyncio
+import logging
+import functools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Dict, Any, Optional
-from groq import Groq
+from groq import Groq, AsyncGroq
+from pydantic import BaseModel
 from dotenv import load_dotenv
 
-load_dotenv()
+from ai.llm_cache import LLMCache, SemanticCache
+
+# orjson parses LLM JSON responses several times faster than stdlib json;
+# fall back silently when it isn't installed
+try:
+    import orjson
+
+    def _json_loads(data):
+        return orjson.loads(data)
+except ImportError:
+    _json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+
+def _safe_json_parse(text: str) -> Dict[str, Any]:
+    """Parse LLM output that should be JSON, salvaging near-valid responses.
+
+    Even with response_format=json_object the model occasionally wraps the
+    object in commentary or gets truncated by the max_tokens cap. Try a
+    direct parse, then the outermost {...} block, then a balanced-brace
+    truncation/repair before giving up.
+    """
+    try:
+        return _json_loads(text)
+    except Exception:
+        pass
+
+    # Outermost {...} block - drops leading/trailing commentary
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            return _json_loads(match.group(0))
+        except Exception:
+            pass
+
+    # Truncated output: walk braces (string-aware) and either stop at the
+    # last balanced close or append the missing closers
+    start = text.find("{")
+    if start == -1:
+        raise ValueError(f"No JSON object in response: {text[:120]!r}")
+
+    depth = 0
+    in_str = False
+    esc = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if esc:
+            esc = False
+            continue
+        if ch == "\\" and in_str:
+            esc = True
+            continue
+        if ch == '"':
+            in_str = not in_str
+        elif not in_str:
+            if ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    return _json_loads(text[start:i + 1])
+
+    candidate = text[start:].rstrip().rstrip(",")
+    if in_str:
+        candidate += '"'
+    candidate += "}" * depth
+    return _json_loads(candidate)
+
+# OCR-trimming patterns: raw OCR carries whitespace runs and page-number
+# boilerplate that inflate prompt tokens without adding signal
+_WS = re.compile(r"[ \t]+")
+_NL = re.compile(r"\n{3,}")
+_PAGE_NOISE = re.compile(r"^\s*(Page \d+|-\s*\d+\s*-)\s*$", re.MULTILINE | re.IGNORECASE)
+
+
+def _preprocess_ocr(text: str) -> str:
+    """Normalize and trim OCR text before it goes into a prompt."""
+    import unicodedata
+
+    text = unicodedata.normalize("NFC", text)
+    text = _PAGE_NOISE.sub("", text)
+    text = _WS.sub(" ", text)
+    text = _NL.sub("\n\n", text)
+    return text.strip()
+
+
+# HTTP statuses worth retrying before surfacing the failure to callers
+_TRANSIENT_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+def _retry_delay(e, attempt: int) -> float:
+    """Backoff for a transient API error: Retry-After if sent, else 2^n, plus jitter."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        delay = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        delay = float(2 ** attempt)
+    return min(delay, 30.0) + random.uniform(0, 1)
+
+
+def _create_with_retry(create, max_attempts: int = 3, **kwargs):
+    """Run a chat.completions.create call, retrying transient HTTP errors.
+
+    A 429 or 5xx gets exponential backoff with jitter (honouring a
+    server-sent Retry-After header, capped at 30s) before the request is
+    reissued; anything else propagates immediately so callers' fallbacks
+    aren't delayed by pointless sleeps.
+    """
+    for attempt in range(max_attempts):
+        try:
+            return create(**kwargs)
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if status not in _TRANSIENT_STATUSES or attempt == max_attempts - 1:
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning("Transient Groq error (HTTP %s), retrying in %.1fs", status, delay)
+            time.sleep(delay)
+
+
+async def _acreate_with_retry(create, max_attempts: int = 3, **kwargs):
+    """Async twin of _create_with_retry for the AsyncGroq client."""
+    for attempt in range(max_attempts):
+        try:
+            return await create(**kwargs)
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if status not in _TRANSIENT_STATUSES or attempt == max_attempts - 1:
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning("Transient Groq error (HTTP %s), retrying in %.1fs", status, delay)
+            await asyncio.sleep(delay)
+
+
+class _StreamingFieldParser:
+    """Incrementally pull completed top-level fields out of streamed JSON.
+
+    Fed delta chunks from a streamed completion, it emits (key, value)
+    pairs as soon as each top-level pair is complete, so downstream code
+    can start consuming fields while the model is still decoding.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._started = False
+
+    def feed(self, chunk: str) -> list:
+        """Add a delta chunk; return any newly completed (key, value) pairs."""
+        self._buf += chunk
+        pairs = []
+        while True:
+            pair = self._next_pair()
+            if pair is None:
+                break
+            pairs.append(pair)
+        return pairs
+
+    def _next_pair(self):
+        buf = self._buf
+        n = len(buf)
+
+        if not self._started:
+            i = buf.find("{")
+            if i == -1:
+                return None
+            self._started = True
+            self._pos = i + 1
+
+        i = self._pos
+        while i < n and (buf[i].isspace() or buf[i] == ","):
+            i += 1
+        if i >= n or buf[i] == "}":
+            return None
+
+        start = i
+        depth = 0
+        in_str = False
+        esc = False
+        while i < n:
+            ch = buf[i]
+            if esc:
+                esc = False
+            elif ch == "\\" and in_str:
+                esc = True
+            elif ch == '"':
+                in_str = not in_str
+            elif not in_str:
+                if ch in "{[":
+                    depth += 1
+                elif ch in "}]":
+                    if depth == 0:  # Closing brace of the whole object
+                        self._pos = i
+                        return self._parse_segment(buf[start:i])
+                    depth -= 1
+                elif ch == "," and depth == 0:
+                    self._pos = i + 1
+                    return self._parse_segment(buf[start:i])
+            i += 1
+        return None
+
+    @staticmethod
+    def _parse_segment(segment: str):
+        segment = segment.strip()
+        if not segment:
+            return None
+        try:
+            obj = _json_loads("{" + segment + "}")
+            return next(iter(obj.items()))
+        except Exception:
+            return None
+
+
+@dataclass(frozen=True, slots=True)
+class GroqConfig:
+    """Immutable Groq settings, read from the environment exactly once.
+
+    Repeated os.getenv/float/int calls per request were pure overhead -
+    the environment doesn't change after startup.
+    """
+    api_key: Optional[str]
+    model: str
+    fast_model: str
+    temperature: float
+    max_tokens: int
+
+    @classmethod
+    def from_env(cls) -> "GroqConfig":
+        return cls(
+            api_key=os.getenv("GROQ_API_KEY"),
+            model=os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile"),
+            fast_model=os.getenv("GROQ_FAST_MODEL", "llama-3.1-8b-instant"),
+            temperature=float(os.getenv("GROQ_TEMPERATURE", "0.1")),
+            max_tokens=int(os.getenv("GROQ_MAX_TOKENS", "2000")),
+        )
+
+
+@functools.lru_cache(maxsize=1)
+def _cfg() -> GroqConfig:
+    """Parse .env and read settings on first use, not at import.
+
+    This module gets imported by the API, the worker, and scripts that
+    never call Groq; deferring load_dotenv() keeps import cheap and
+    avoids re-parsing .env per uvicorn worker that doesn't need it.
+    """
+    load_dotenv()
+    return GroqConfig.from_env()
+
+# Shared response cache - identical (model, prompts, temperature) requests
+# are served from disk instead of paying a Groq round-trip
+_llm_cache = LLMCache()
+
+# In-process memo for the key-value normalizer: boilerplate inputs
+# ("N/A", "see attached") and recurring diagnoses repeat constantly, and a
+# dict hit is microseconds vs. a disk-cache read. Lock because FastAPI
+# runs sync endpoints on a thread pool.
+_kv_memo: OrderedDict = OrderedDict()
+_kv_memo_lock = threading.Lock()
+_KV_MEMO_MAX = 4096
+
+# Near-duplicate lookup for when scanner noise defeats the exact hash
+# (opt-in via LLM_SEMANTIC_CACHE=true; needs sentence-transformers + faiss)
+_semantic_cache = SemanticCache()
+
+# Bound concurrent Groq fan-out so a burst of documents can't exhaust
+# rate limits or sockets; created lazily so GROQ_MAX_CONCURRENT from .env
+# is honoured (dotenv is parsed on first _cfg() call, not at import)
+@functools.lru_cache(maxsize=1)
+def _llm_semaphore() -> asyncio.Semaphore:
+    _cfg()
+    return asyncio.Semaphore(int(os.getenv("GROQ_MAX_CONCURRENT", "32")))
+
+# Static system prompts, built once at import. Besides skipping per-call
+# string construction, a byte-identical prefix is what lets the provider's
+# prompt cache hit across requests.
+SYSTEM_PROMPT_EXTRACT = """You are a medical document extraction engine. Extract the requested fields exactly as written in the document and return only valid JSON.
+
+Return a single JSON object mapping field names (patient_id, patient_name,
+surname, age, gender, date_of_birth, phone, mobile, email, address, suburb,
+state, occupation, hospital_name, hospital_address, insurance_id,
+insurance_type, group_number, subscriber_name, medicare_no, medicare_ref,
+health_fund, health_fund_no, vet_affairs, visit_date, procedure, doctor_name,
+gp_name, referrer, chief_complaint, comments, blood_pressure, pulse,
+temperature, weight, spo2, diagnosis) to their values. Use null for fields
+that are not present. Do not invent values."""
+
+SYSTEM_PROMPT_SUMMARY = """You are a helpful medical assistant. Summarize medical documents clearly and accurately.
+Your summary should cover the key medical details (patient issues, diagnosis, medications, key results) in 3-5 sentences.
+Return ONLY a JSON object with a single key "Summary" containing the text summary."""
+
+SYSTEM_PROMPT_EXTRACT_ALL = SYSTEM_PROMPT_EXTRACT + """
+
+Return the result as a single JSON object with exactly two keys:
+- "fields": the field-name -> value object described above
+- "summary": a 3-5 sentence summary of the key medical details"""
+
+SYSTEM_PROMPT_EXTRACT_MULTI = SYSTEM_PROMPT_EXTRACT + """
+
+You will receive several documents as a JSON array of {"id": ..., "ocr": ...}
+objects. Return a single JSON object {"results": [{"id": ..., "fields": {...}},
+...]} with exactly one entry per input id."""
+
+
+# Field groups for fan-out extraction: four small focused prompts that run
+# concurrently, so wall time is the slowest group instead of one big decode
+_SCHEMA_GROUPS = {
+    "demographics": (
+        "patient_id", "patient_name", "surname", "age", "gender",
+        "date_of_birth", "phone", "mobile", "email", "address", "suburb",
+        "state", "occupation",
+    ),
+    "insurance": (
+        "hospital_name", "hospital_address", "insurance_id", "insurance_type",
+        "group_number", "subscriber_name", "medicare_no", "medicare_ref",
+        "health_fund", "health_fund_no", "vet_affairs",
+    ),
+    "vitals": (
+        "blood_pressure", "pulse", "temperature", "weight", "spo2",
+    ),
+    "narrative": (
+        "visit_date", "procedure", "doctor_name", "gp_name", "referrer",
+        "chief_complaint", "comments", "diagnosis",
+    ),
+}
+
+class ExtractedTemplate(BaseModel):
+    """Schema guard for extraction responses.
+
+    json.loads only checks syntax; this checks shape. Validating and
+    dumping guarantees every schema field is present (missing ones become
+    None) and silently drops keys the model invented, so downstream code
+    never KeyErrors on a half-formed response. Values stay untyped - OCR
+    fields arrive as strings or numbers depending on the document.
+    """
+    patient_id: Optional[Any] = None
+    patient_name: Optional[Any] = None
+    surname: Optional[Any] = None
+    age: Optional[Any] = None
+    gender: Optional[Any] = None
+    date_of_birth: Optional[Any] = None
+    phone: Optional[Any] = None
+    mobile: Optional[Any] = None
+    email: Optional[Any] = None
+    address: Optional[Any] = None
+    suburb: Optional[Any] = None
+    state: Optional[Any] = None
+    occupation: Optional[Any] = None
+    hospital_name: Optional[Any] = None
+    hospital_address: Optional[Any] = None
+    insurance_id: Optional[Any] = None
+    insurance_type: Optional[Any] = None
+    group_number: Optional[Any] = None
+    subscriber_name: Optional[Any] = None
+    medicare_no: Optional[Any] = None
+    medicare_ref: Optional[Any] = None
+    health_fund: Optional[Any] = None
+    health_fund_no: Optional[Any] = None
+    vet_affairs: Optional[Any] = None
+    visit_date: Optional[Any] = None
+    procedure: Optional[Any] = None
+    doctor_name: Optional[Any] = None
+    gp_name: Optional[Any] = None
+    referrer: Optional[Any] = None
+    chief_complaint: Optional[Any] = None
+    comments: Optional[Any] = None
+    blood_pressure: Optional[Any] = None
+    pulse: Optional[Any] = None
+    temperature: Optional[Any] = None
+    weight: Optional[Any] = None
+    spo2: Optional[Any] = None
+    diagnosis: Optional[Any] = None
+
+    class Config:
+        extra = "ignore"
+
+
+# One static system prompt per group, built once like SYSTEM_PROMPT_EXTRACT
+_GROUP_SYSTEM_PROMPTS = {
+    group: (
+        "You are a medical document extraction engine. Extract the requested "
+        "fields exactly as written in the document and return only valid JSON.\n\n"
+        "Return a single JSON object mapping field names ("
+        + ", ".join(fields)
+        + ") to their values. Use null for fields that are not present. "
+        "Do not invent values."
+    )
+    for group, fields in _SCHEMA_GROUPS.items()
+}
+
+# Deterministic field patterns - these don't need a 70B model to find
+_EMAIL = re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b")
+# Anchored on a label or unit so date fragments like 12/03 don't match
+_BP = re.compile(r"(?:\bB\.?P\.?\b|Blood Pressure)[:\s]*(\d{2,3}/\d{2,3})|(\d{2,3}/\d{2,3})\s*mm\s*Hg", re.IGNORECASE)
+_DOB = re.compile(r"\b(?:DOB|D\.O\.B\.?|Date of Birth)[:\s]*([0-9]{1,2}[/-][0-9]{1,2}[/-][0-9]{2,4})\b", re.IGNORECASE)
+
+
+def _regex_prefill(ocr_text: str) -> Dict[str, str]:
+    """Pull trivially regex-able fields straight from the OCR text.
+
+    Emails, blood pressure readings, and labelled dates of birth have
+    rigid shapes; matching them locally is free and also backstops the
+    LLM when it returns null for a field that is plainly present.
+    """
+    prefilled: Dict[str, str] = {}
+    m = _EMAIL.search(ocr_text)
+    if m:
+        prefilled["email"] = m.group(0)
+    m = _BP.search(ocr_text)
+    if m:
+        prefilled["blood_pressure"] = m.group(1) or m.group(2)
+    m = _DOB.search(ocr_text)
+    if m:
+        prefilled["date_of_birth"] = m.group(1)
+    return prefilled
+
+
+@functools.lru_cache(maxsize=32)
+def _system_msg(content: str) -> dict:
+    """One shared {"role": "system", ...} dict per distinct prompt.
+
+    The system prompts are a handful of module constants, so every call
+    can reuse the same message dict instead of allocating a fresh one.
+    Treat the returned dict as frozen - never mutate it.
+    """
+    return {"role": "system", "content": content}
+
+
+def _estimate_max_tokens(ocr_text: str, floor: int = 512, ceil: int = 2048) -> int:
+    """Size max_tokens to the document instead of always paying for 2048.
+
+    The extracted JSON can't contain more content than the OCR text it
+    came from, so budget roughly chars/4 (the usual token ratio) plus
+    headroom for the 37 field names and JSON punctuation. Short documents
+    get a much smaller decode ceiling, which caps worst-case latency.
+    """
+    return max(floor, min(ceil, 300 + len(ocr_text) // 4))
+
 
 class GroqService:
     """Service for interacting with Groq API for LLM-based extraction."""
     
-    def _init_(self):
+    def __init__(self):
         """Initialize Groq client with API key."""
-        self.api_key = os.getenv("GROQ_API_KEY")
+        self.api_key = _cfg().api_key
         if not self.api_key:
             raise ValueError(
                 "GROQ_API_KEY not found in environment variables. "
                 "Please create a .env file with your Groq API key."
             )
-        
-        self.client = Groq(api_key=self.api_key)
-        self.model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-        self.temperature = float(os.getenv("GROQ_TEMPERATURE", "0.1"))
-        self.max_tokens = int(os.getenv("GROQ_MAX_TOKENS", "2000"))
+
+        self.client = Groq(api_key=self.api_key, http_client=self._build_sync_http_client())
+        self.aclient = AsyncGroq(api_key=self.api_key, http_client=self._build_http_client())
+        self.model = _cfg().model
+        self.fast_model = _cfg().fast_model
+        self.temperature = _cfg().temperature
+        self.max_tokens = _cfg().max_tokens
     
-    def extract_full_template(self, ocr_text: str) -> Dict[str, Any]:
+    @staticmethod
+    def _build_sync_http_client():
+        """Explicit keep-alive pool and timeout bounds for the sync client.
+
+        One client lives for the service's lifetime, so every request
+        reuses warm TCP+TLS connections instead of paying handshake RTT.
+        Returns None (SDK default client) if httpx is unavailable.
         """
-        Direct extraction: Map OCR text to complete template in ONE step.
-        This is the primary extraction method - simple and accurate.
+        try:
+            import httpx
+            return httpx.Client(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                timeout=httpx.Timeout(30.0, connect=5.0),
+            )
+        except Exception as e:
+            logger.debug("Falling back to default sync Groq http client: %s", e)
+            return None
+
+    @staticmethod
+    def _build_http_client():
+        """Tuned httpx transport for the async Groq client.
+
+        HTTP/2 multiplexes the gather() fan-out over one TLS connection
+        and the larger keepalive pool avoids handshake churn under
+        concurrent load. Returns None (SDK default client) if httpx or
+        the h2 extra is unavailable.
         """
-        print("\n" + "="*80)
-        print("🔍 GROQ SERVICE - extract_key_value_pairs() called")
-        print("="*80)
-        print(f"📄 Input OCR Text Length: {len(ocr_text)} characters")
-        print(f"📋 Document Type: {document_type}")
-        print(f"📝 First 200 chars of OCR: {ocr_text[:200]}...")
-        
-        # Build the prompt based on document type
-        prompt = self._build_extraction_prompt(ocr_text, document_type)
-        print(f"\n✉  Prompt Built - Length: {len(prompt)} characters")
-        
         try:
-            response = self.client.chat.completions.create(
+            import httpx
+            return httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=256, max_keepalive_connections=128),
+                timeout=httpx.Timeout(60.0, connect=5.0),
+            )
+        except Exception as e:
+            logger.debug("Falling back to default Groq http client: %s", e)
+            return None
+
+    def _chat_json_with_retry(self, system_prompt: str, user_prompt: str,
+                              temperature: float, max_tokens: int,
+                              max_retries: int = 2, schema=None) -> Dict[str, Any]:
+        """Completion that must parse as JSON, with validation feedback.
+
+        If the response doesn't parse - or fails the optional pydantic
+        schema - the bad output and the error are appended to the
+        conversation and the model is asked to fix it: a couple of cheap
+        retries recover most malformed responses instead of discarding
+        the whole extraction.
+        """
+        messages = [
+            _system_msg(system_prompt),
+            {"role": "user", "content": user_prompt}
+        ]
+
+        last_err = None
+        for attempt in range(max_retries + 1):
+            response = _create_with_retry(
+                self.client.chat.completions.create,
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.0,
-                max_tokens=2048,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
                 response_format={"type": "json_object"}
             )
-            
             content = response.choices[0].message.content
-            extracted = json.loads(content)
-            
-            # Log what was extracted
-            filled_fields = sum(1 for v in extracted.values() if v not in [None, "", "null", "N/A"])
-            print(f"✅ Groq extracted {filled_fields} fields from OCR text")
-            
+            try:
+                parsed = _safe_json_parse(content)
+                if schema is not None:
+                    parsed = schema(**parsed).dict()
+                return parsed
+            except Exception as err:
+                last_err = err
+                logger.warning("JSON parse failed (attempt %d/%d): %s",
+                               attempt + 1, max_retries + 1, err)
+                messages = messages + [
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": f"Your output had error: {err}. Fix and retry as valid JSON."}
+                ]
+                time.sleep(1.0 * (attempt + 1))
+
+        raise last_err
+
+    def _extraction_prompts(self, ocr_text: str, document_type: Optional[str] = None):
+        """Build (system, user) prompts for full-template extraction.
+
+        All invariant instructions (role, field schema) live in the
+        system prompt and the variable OCR text comes last, so providers
+        that hash-cache identical prompt prefixes skip re-prefilling the
+        static tokens on every call.
+        """
+        user_prompt = f"""Document Type: {document_type if document_type else "Unknown"}
+
+OCR TEXT:
+{_preprocess_ocr(ocr_text)}
+
+Return the complete JSON."""
+
+        return SYSTEM_PROMPT_EXTRACT, user_prompt
+
+    def _build_extraction_prompt(self, ocr_text: str, document_type: Optional[str] = None) -> str:
+        """Build the user prompt for full-template extraction."""
+        return self._extraction_prompts(ocr_text, document_type)[1]
+
+    def extract_full_template(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Direct extraction: Map OCR text to complete template in ONE step.
+        This is the primary extraction method - simple and accurate.
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("extract_full_template: %d chars, type=%s, preview=%r",
+                         len(ocr_text), document_type, ocr_text[:200])
+
+        system_prompt, user_prompt = self._extraction_prompts(ocr_text, document_type)
+
+        cache_key = _llm_cache.make_key(self.model, system_prompt, user_prompt, 0.0)
+        cached = _llm_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("extract_full_template: cache hit")
+            return cached
+
+        near = _semantic_cache.get(user_prompt)
+        if near is not None:
+            logger.debug("extract_full_template: semantic cache hit")
+            return near
+
+        try:
+            extracted = self._chat_json_with_retry(system_prompt, user_prompt,
+                                                   temperature=0.0, max_tokens=_estimate_max_tokens(ocr_text),
+                                                   schema=ExtractedTemplate)
+
+            # Log what was extracted (keys only - never re-serialize the payload)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("extract_full_template: extracted keys=%s", list(extracted))
+
+            # Backfill regex-certain fields the model missed or nulled
+            for field, value in _regex_prefill(ocr_text).items():
+                if not extracted.get(field):
+                    extracted[field] = value
+
+            _llm_cache.set(cache_key, extracted, model=self.model)
+            _semantic_cache.add(user_prompt, extracted)
             return extracted
         except Exception as e:
-            print(f"❌ Groq extraction error: {e}")
+            logger.warning("Groq extraction error: %s", e)
             return {"error": str(e), "raw_text_preview": ocr_text[:200]}
 
+    def stream_extract_full_template(self, ocr_text: str, document_type: Optional[str] = None):
+        """
+        Streaming variant of extract_full_template: yield (field, value)
+        pairs as the model emits them instead of waiting for the full
+        response, so callers can render/process early fields immediately.
+        """
+        system_prompt, user_prompt = self._extraction_prompts(ocr_text, document_type)
+
+        # Serve from cache when possible - yield fields in stored order
+        cache_key = _llm_cache.make_key(self.model, system_prompt, user_prompt, 0.0)
+        cached = _llm_cache.get(cache_key)
+        if cached is not None and isinstance(cached, dict):
+            logger.debug("stream_extract_full_template: cache hit")
+            yield from cached.items()
+            return
+
+        stream = _create_with_retry(
+            self.client.chat.completions.create,
+            model=self.model,
+            messages=[
+                _system_msg(system_prompt),
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.0,
+            max_tokens=_estimate_max_tokens(ocr_text),
+            stream=True,
+        )
+
+        parser = _StreamingFieldParser()
+        collected: Dict[str, Any] = {}
+        raw_parts = []
+        finish_reason = None
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason is not None:
+                finish_reason = choice.finish_reason
+            delta = choice.delta.content
+            if not delta:
+                continue
+            raw_parts.append(delta)
+            for field, value in parser.feed(delta):
+                collected[field] = value
+                yield field, value
+
+        # The cache key is shared with extract_full_template, whose hits
+        # skip schema validation and regex backfill - so only store
+        # streams that finished cleanly AND parse as a full valid
+        # template, never output truncated by the max_tokens cap
+        if collected and finish_reason == "stop":
+            try:
+                parsed = ExtractedTemplate(**_safe_json_parse("".join(raw_parts))).dict()
+                _llm_cache.set(cache_key, parsed, model=self.model)
+            except Exception as e:
+                logger.debug("stream_extract_full_template: not caching incomplete stream: %s", e)
+
+    @staticmethod
+    def _kv_memoize(key, value):
+        """Insert into the bounded in-process memo, evicting oldest first."""
+        with _kv_memo_lock:
+            _kv_memo[key] = value
+            _kv_memo.move_to_end(key)
+            while len(_kv_memo) > _KV_MEMO_MAX:
+                _kv_memo.popitem(last=False)
+
+    @staticmethod
+    def _looks_low_quality(parsed: Dict[str, Any]) -> bool:
+        """Escalation heuristic: mostly-empty output from the fast model."""
+        if not parsed or "error" in parsed:
+            return True
+        values = list(parsed.values())
+        empty = sum(1 for v in values if v in (None, "", "null", "N/A"))
+        return empty > 0.3 * len(values)
+
     def extract_key_value_pairs(
-        self, 
+        self,
         comments_text: str = "",
         diagnosis_text: str = ""
     ) -> Dict[str, Any]:
@@ -78,6 +706,12 @@ class GroqService:
         if not self.api_key:
             return {"error": "GROQ_API_KEY not configured"}
 
+        memo_key = (comments_text, diagnosis_text, self.fast_model)
+        with _kv_memo_lock:
+            if memo_key in _kv_memo:
+                _kv_memo.move_to_end(memo_key)
+                return _kv_memo[memo_key]
+
         system_prompt = """You are a clinical text normalizer. 
 Clean up OCR noise and normalize medical terminology.
 Return only the cleaned versions of comments and diagnosis."""
@@ -95,25 +729,41 @@ Return JSON:
   "comments": "<cleaned comments>",
   "diagnosis": "<cleaned diagnosis>"
 }}"""
-        
+
+        cache_key = _llm_cache.make_key(self.fast_model, system_prompt, user_prompt, 0.0)
+        cached = _llm_cache.get(cache_key)
+        if cached is not None:
+            self._kv_memoize(memo_key, cached)
+            return cached
+
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.0,
-                max_tokens=512,
-                response_format={"type": "json_object"}
-            )
-            
-            content = response.choices[0].message.content
-            return json.loads(content)
+            # Narrow deterministic task: the 8B tier is usually enough, and
+            # the big model only runs when its output looks degenerate
+            parsed: Dict[str, Any] = {}
+            for model in (self.fast_model, self.model):
+                response = _create_with_retry(
+                    self.client.chat.completions.create,
+                    model=model,
+                    messages=[
+                        _system_msg(system_prompt),
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.0,
+                    max_tokens=512,
+                    response_format={"type": "json_object"}
+                )
+
+                parsed = _safe_json_parse(response.choices[0].message.content)
+                if not self._looks_low_quality(parsed):
+                    break
+                logger.debug("%s output looks low quality, escalating to %s",
+                             model, self.model)
+
+            _llm_cache.set(cache_key, parsed, model=model)
+            self._kv_memoize(memo_key, parsed)
+            return parsed
         except Exception as e:
-            print(f"\n❌ Groq API Error: {type(e)._name_}: {e}")
-            print(f"❌ Full Error: {repr(e)}")
-            print("="*80)
+            logger.warning("Groq API error: %s: %s", type(e).__name__, e)
             # Return fallback structure
             return {
                 "error": str(e),
@@ -121,41 +771,316 @@ Return JSON:
                 "diagnosis": diagnosis_text
             }
 
-    def summarize_text(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
-        """Summarize OCR text using Groq's LLM."""
-        prompt = f"""Please provide a clear, concise summary of this medical document.
-        
-Document Type: {document_type if document_type else "Unknown"}
+    def _summary_prompts(self, ocr_text: str, document_type: Optional[str] = None):
+        """Build (system, user) prompts for summarization - static part first."""
+        user_prompt = f"""Document Type: {document_type if document_type else "Unknown"}
 
 OCR Text:
-{ocr_text}
+{_preprocess_ocr(ocr_text)}"""
 
-Your summary should cover the key medical details (patient issues, diagnosis, medications, key results) in 3-5 sentences.
-Return ONLY a JSON object with a single key "Summary" containing the text summary."""
+        return SYSTEM_PROMPT_SUMMARY, user_prompt
+
+    def summarize_text(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Summarize OCR text using Groq's LLM."""
+        system_prompt, prompt = self._summary_prompts(ocr_text, document_type)
+
+        cache_key = _llm_cache.make_key(self.fast_model, system_prompt, prompt, 0.3)
+        cached = _llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
+            # Summaries don't need the 70B tier - the instant model is
+            # several times faster for the same few sentences
+            response = _create_with_retry(
+                self.client.chat.completions.create,
+                model=self.fast_model,
                 messages=[
-                    {"role": "system", "content": "You are a helpful medical assistant. Summarize medical documents clearly and accurately."},
+                    _system_msg(system_prompt),
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
                 max_tokens=500,
                 response_format={"type": "json_object"}
             )
-            
-            return json.loads(response.choices[0].message.content)
+
+            parsed = _safe_json_parse(response.choices[0].message.content)
+            _llm_cache.set(cache_key, parsed, model=self.fast_model)
+            return parsed
+        except Exception as e:
+            return {"Raw Text Preview": ocr_text[:500] + "..."}
+
+    # ------------------------------------------------------------------
+    # Async API - lets callers fan out independent calls with gather()
+    # so wall time is max(T1..Tn) instead of the sum
+    # ------------------------------------------------------------------
+
+    async def _achat(self, system_prompt: str, user_prompt: str,
+                     temperature: float, max_tokens: int) -> Dict[str, Any]:
+        """Shared async completion call with cache + concurrency bound."""
+        cache_key = _llm_cache.make_key(self.model, system_prompt, user_prompt, temperature)
+        cached = _llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        async with _llm_semaphore():
+            response = await _acreate_with_retry(
+                self.aclient.chat.completions.create,
+                model=self.model,
+                messages=[
+                    _system_msg(system_prompt),
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                response_format={"type": "json_object"}
+            )
+
+        parsed = _safe_json_parse(response.choices[0].message.content)
+        _llm_cache.set(cache_key, parsed, model=self.model)
+        return parsed
+
+    async def a_extract_full_template(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of extract_full_template."""
+        system_prompt, user_prompt = self._extraction_prompts(ocr_text, document_type)
+        try:
+            extracted = await self._achat(system_prompt, user_prompt, temperature=0.0,
+                                          max_tokens=_estimate_max_tokens(ocr_text))
+            for field, value in _regex_prefill(ocr_text).items():
+                if not extracted.get(field):
+                    extracted[field] = value
+            return extracted
+        except Exception as e:
+            return {"error": str(e), "raw_text_preview": ocr_text[:200]}
+
+    async def a_extract_grouped(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Extract the template as four concurrent per-group calls.
+
+        Each group (demographics, insurance, vitals, narrative) gets a
+        small focused prompt; gather() runs them in parallel under the
+        shared semaphore, so latency is the slowest group's decode rather
+        than one 37-field response. Results merge into one flat dict.
+        """
+        user_prompt = self._extraction_prompts(ocr_text, document_type)[1]
+        groups = list(_GROUP_SYSTEM_PROMPTS)
+
+        results = await asyncio.gather(
+            *(self._achat(_GROUP_SYSTEM_PROMPTS[g], user_prompt,
+                          temperature=0.0, max_tokens=_estimate_max_tokens(ocr_text, ceil=1024))
+              for g in groups),
+            return_exceptions=True,
+        )
+
+        merged: Dict[str, Any] = {}
+        for group, result in zip(groups, results):
+            if isinstance(result, Exception):
+                logger.warning("Group %s extraction failed: %s", group, result)
+                merged.update(dict.fromkeys(_SCHEMA_GROUPS[group]))
+            else:
+                merged.update(result)
+
+        for field, value in _regex_prefill(ocr_text).items():
+            if not merged.get(field):
+                merged[field] = value
+        return merged
+
+    def extract_grouped(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Sync wrapper for a_extract_grouped."""
+        return asyncio.run(self.a_extract_grouped(ocr_text, document_type))
+
+    async def a_summarize_text(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of summarize_text."""
+        system_prompt, prompt = self._summary_prompts(ocr_text, document_type)
+        try:
+            return await self._achat(system_prompt, prompt, temperature=0.3, max_tokens=500)
         except Exception as e:
             return {"Raw Text Preview": ocr_text[:500] + "..."}
 
+    def _extract_all_prompts(self, ocr_text: str, document_type: Optional[str] = None):
+        """Build (system, user) prompts for the fused extract+summarize call."""
+        user_prompt = self._extraction_prompts(ocr_text, document_type)[1]
+        return SYSTEM_PROMPT_EXTRACT_ALL, user_prompt
+
+    def extract_all(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Extract the full template AND a summary in one LLM call.
+
+        One request instead of two drops an entire prefill+decode cycle
+        per document - the OCR text is only uploaded and attended once.
+        Returns {"fields": {...}, "summary": "..."}.
+        """
+        system_prompt, user_prompt = self._extract_all_prompts(ocr_text, document_type)
+
+        cache_key = _llm_cache.make_key(self.model, system_prompt, user_prompt, 0.0)
+        cached = _llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            parsed = self._chat_json_with_retry(system_prompt, user_prompt,
+                                                temperature=0.0, max_tokens=_estimate_max_tokens(ocr_text))
+            _llm_cache.set(cache_key, parsed, model=self.model)
+            return parsed
+        except Exception as e:
+            logger.warning("Groq fused extraction error: %s", e)
+            return {"error": str(e), "raw_text_preview": ocr_text[:200]}
+
+    async def a_extract_all(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of extract_all."""
+        system_prompt, user_prompt = self._extract_all_prompts(ocr_text, document_type)
+        try:
+            return await self._achat(system_prompt, user_prompt, temperature=0.0, max_tokens=_estimate_max_tokens(ocr_text))
+        except Exception as e:
+            return {"error": str(e), "raw_text_preview": ocr_text[:200]}
+
+    async def a_extract_and_summarize(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Extract + summarize for one document (single fused LLM call)."""
+        result = await self.a_extract_all(ocr_text, document_type)
+        if "error" in result:
+            return {"extracted": result, "summary": {}}
+        return {"extracted": result.get("fields", {}), "summary": {"Summary": result.get("summary")}}
+
+    def extract_and_summarize(self, ocr_text: str, document_type: Optional[str] = None) -> Dict[str, Any]:
+        """Sync wrapper around the fused extract + summarize call."""
+        return asyncio.run(self.a_extract_and_summarize(ocr_text, document_type))
+
+    def extract_full_template_multi(self, ocr_texts: list, max_docs_per_call: int = 8) -> list:
+        """Extract templates for several documents in one completion each.
+
+        Packs up to max_docs_per_call documents into a single prompt and
+        asks for a results array keyed by id, so the schema/instruction
+        tokens are paid once per group instead of once per document and
+        N provider queue waits collapse into one. Returns one result
+        dict per input text, in order; documents the model drops from
+        the array fall back to individual calls.
+        """
+        results: list = [None] * len(ocr_texts)
+
+        for start in range(0, len(ocr_texts), max_docs_per_call):
+            group = ocr_texts[start:start + max_docs_per_call]
+            payload = json.dumps(
+                [{"id": i, "ocr": _preprocess_ocr(text)} for i, text in enumerate(group)],
+                separators=(",", ":"),
+            )
+            user_prompt = f"Documents:\n{payload}\n\nReturn the complete JSON."
+            budget = min(8192, sum(_estimate_max_tokens(t) for t in group))
+
+            cache_key = _llm_cache.make_key(self.model, SYSTEM_PROMPT_EXTRACT_MULTI, user_prompt, 0.0)
+            parsed = _llm_cache.get(cache_key)
+            if parsed is None:
+                try:
+                    parsed = self._chat_json_with_retry(SYSTEM_PROMPT_EXTRACT_MULTI, user_prompt,
+                                                        temperature=0.0, max_tokens=budget)
+                    _llm_cache.set(cache_key, parsed, model=self.model)
+                except Exception as e:
+                    logger.warning("Multi-doc extraction failed for group at %d: %s", start, e)
+                    parsed = {}
+
+            by_id = {}
+            for entry in parsed.get("results", []):
+                if isinstance(entry, dict) and "id" in entry:
+                    by_id[entry["id"]] = entry.get("fields", entry)
+
+            for i, text in enumerate(group):
+                result = by_id.get(i)
+                if result is None:  # Model dropped this document - do it alone
+                    result = self.extract_full_template(text)
+                results[start + i] = result
+
+        return results
+
+    # ------------------------------------------------------------------
+    # Batch API - bulk/nightly re-extraction at ~50% token cost, with a
+    # fallback to interactive calls if the batch takes too long
+    # ------------------------------------------------------------------
+
+    def extract_full_template_batch(self, ocr_texts: list, batch_timeout_minutes: int = 60) -> list:
+        """Extract templates for many documents via the Groq Batch API.
+
+        Returns one result dict per input text, in order. If the batch
+        hasn't completed within batch_timeout_minutes it is cancelled and
+        the remaining documents fall back to per-document calls.
+        """
+        import io
+        import time
+
+        lines = []
+        for i, ocr_text in enumerate(ocr_texts):
+            system_prompt, user_prompt = self._extraction_prompts(ocr_text)
+            lines.append(json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model,
+                    "messages": [
+                        _system_msg(system_prompt),
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    "temperature": 0.0,
+                    "max_tokens": _estimate_max_tokens(ocr_text),
+                    "response_format": {"type": "json_object"}
+                }
+            }, separators=(",", ":")))
+
+        try:
+            batch_file = self.client.files.create(
+                file=("batch.jsonl", io.BytesIO("\n".join(lines).encode())),
+                purpose="batch"
+            )
+            batch = self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            logger.info("Submitted Groq batch %s with %d documents", batch.id, len(ocr_texts))
+
+            deadline = time.time() + batch_timeout_minutes * 60
+            delay = 5
+            while time.time() < deadline:
+                batch = self.client.batches.retrieve(batch.id)
+                if batch.status == "completed":
+                    break
+                if batch.status in ("failed", "expired", "cancelled"):
+                    raise RuntimeError(f"Batch ended with status {batch.status}")
+                time.sleep(delay)
+                delay = min(delay * 2, 60)  # Exponential backoff, capped
+            else:
+                logger.warning("Groq batch timed out - cancelling and falling back to sync calls")
+                try:
+                    self.client.batches.cancel(batch.id)
+                except Exception:
+                    pass
+                raise TimeoutError("Groq batch did not finish in time")
+
+            content = self.client.files.content(batch.output_file_id)
+            raw = content.read() if hasattr(content, "read") else content.text
+            if isinstance(raw, bytes):
+                raw = raw.decode()
+
+            results = [None] * len(ocr_texts)
+            for line in raw.splitlines():
+                if not line.strip():
+                    continue
+                entry = _json_loads(line)
+                idx = int(entry["custom_id"])
+                body = entry["response"]["body"]
+                results[idx] = _safe_json_parse(body["choices"][0]["message"]["content"])
+
+            # Any stragglers (missing lines) go through the sync path
+            for i, r in enumerate(results):
+                if r is None:
+                    results[i] = self.extract_full_template(ocr_texts[i])
+            return results
+
+        except Exception as e:
+            logger.warning("Batch extraction failed (%s), falling back to per-document calls", e)
+            return [self.extract_full_template(t) for t in ocr_texts]
 
-# Singleton instance
-_groq_service = None
 
+# Singleton accessor - lru_cache is thread-safe, so concurrent FastAPI
+# threadpool requests can't race and build duplicate Groq clients (each
+# of which would open its own HTTP connection pool)
+@functools.lru_cache(maxsize=1)
 def get_groq_service() -> GroqService:
     """Get or create the Groq service singleton."""
-    global _groq_service
-    if _groq_service is None:
-        _groq_service = GroqService()
-    return _groq_service
\ No newline at end of file
+    return GroqService()
\ No newline at end of file
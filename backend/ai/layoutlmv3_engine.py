@@ -1,4 +1,10 @@
 import os
+
+# Tesseract's internal OpenMP threading slows OCR down on multi-core
+# hosts; force single-threaded and parallelize across processes instead
+# (must be set before pytesseract/tesseract loads)
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import torch
 import pytesseract
 import numpy as np
@@ -17,6 +23,12 @@ if os.path.exists(TESSERACT_PATH):
 else:
     print("⚠️ Tesseract NOT found at default path. Ensure it's installed or set TESSERACT_PATH environment variable.")
 
+# --psm 11 (sparse text) skips the full page-segmentation analysis that
+# the default PSM runs before OCR - form fields are scattered words, not
+# reflowable blocks - and --oem 1 forces the LSTM engine with no legacy
+# fallback. Overridable for unusual layouts.
+TESSERACT_CONFIG = os.getenv("TESSERACT_CONFIG", "--psm 11 --oem 1")
+
 FIELD_LABELS = {
     "patient_name": ["First name", "Name"],
     "surname": ["Surname"],
@@ -41,37 +53,176 @@ FIELD_LABELS = {
     "diagnosis": ["Diagnosis"]
 }
 
+# Lowercased once at import - the matching loops never call .lower() on a
+# label again
+FIELD_LABELS_LOWER = {
+    field: tuple(label.lower() for label in labels)
+    for field, labels in FIELD_LABELS.items()
+}
+
+# Shared contrast equalizer for OCR preprocessing (stateless, build once)
+_CLAHE = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+
+
+def _normalize(img: np.ndarray, mean, std) -> np.ndarray:
+    """Mean/std normalize an image with OpenCV's SIMD primitives.
+
+    cv2.multiply(cv2.subtract(...)) runs the arithmetic in optimized
+    vector loops, several times faster than the equivalent numpy
+    broadcast at page sizes. Tesseract needs no normalization itself;
+    this is the input path for when a learned layout model (the class's
+    namesake) gets wired in.
+    """
+    mean_np = np.asarray(mean, dtype=np.float32).reshape(1, 1, -1)
+    inv_std = (1.0 / np.asarray(std, dtype=np.float32)).reshape(1, 1, -1)
+    return cv2.multiply(cv2.subtract(img.astype(np.float32), mean_np), inv_std)
+
+# Optional Numba kernel for the spatial candidate scan: for the few
+# hundred boxes of a typical form, a compiled loop beats even vectorized
+# numpy because it skips ufunc launch and temporary arrays
+try:
+    import numba
+
+    @numba.njit(cache=True)
+    def _candidates_njit(boxes, anchor_y, anchor_x1, tol):
+        out = np.empty(boxes.shape[0], dtype=np.int64)
+        k = 0
+        for j in range(boxes.shape[0]):
+            if abs(boxes[j, 1] - anchor_y) < tol and boxes[j, 0] > anchor_x1:
+                out[k] = j
+                k += 1
+        return out[:k]
+except ImportError:
+    _candidates_njit = None
+
+
+# Single-pass label matching: one automaton walk per word replaces a
+# substring test per (field, label) pair. Optional - the nested-loop scan
+# remains as fallback when pyahocorasick isn't installed.
+try:
+    import ahocorasick
+
+    _label_to_fields = {}
+    for _field, _labels in FIELD_LABELS.items():
+        for _label in _labels:
+            # Some labels ("Address") anchor more than one field
+            _label_to_fields.setdefault(_label.lower(), []).append(_field)
+
+    LABEL_AUTOMATON = ahocorasick.Automaton()
+    for _label, _fields in _label_to_fields.items():
+        LABEL_AUTOMATON.add_word(_label, tuple(_fields))
+    LABEL_AUTOMATON.make_automaton()
+except ImportError:
+    LABEL_AUTOMATON = None
+
+
+class _LayoutResult(dict):
+    """Extraction dict whose "_raw_ocr" value materializes on first access.
+
+    The joined OCR text only matters to the LLM-context path; deferring
+    the " ".join saves one O(total chars) allocation per document for
+    layout-only consumers.
+    """
+
+    def __init__(self, fields: Dict[str, Any], words: List[str]):
+        super().__init__(fields)
+        self._words = words
+
+    def __missing__(self, key):
+        if key == "_raw_ocr":
+            value = " ".join(self._words)
+            self[key] = value
+            return value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        # dict.get bypasses __missing__, so route the lazy key through it
+        if key == "_raw_ocr":
+            return self[key]
+        return super().get(key, default)
+
+
 class LayoutLMv3Engine:
     """Spacial-aware OCR engine for medical registration forms."""
     
     @staticmethod
     def ocr_with_boxes(image: Image.Image) -> Tuple[List[str], List[List[int]]]:
         """Perform OCR and extract word bounding boxes."""
-        img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+        # CLAHE evens out scan lighting and Otsu binarization hands
+        # Tesseract a clean 1-channel image (1/3 the bytes), letting it
+        # skip its internal binarization and spend less LSTM time on
+        # spurious regions
+        gray = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
+        gray = _CLAHE.apply(gray)
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+        data = pytesseract.image_to_data(binary, output_type=pytesseract.Output.DICT,
+                                         config=TESSERACT_CONFIG)
 
-        words, boxes = [], []
-        h, w = img.shape[:2]
+        w, h = image.size
 
-        for i in range(len(data["text"])):
-            txt = data["text"][i].strip()
-            if not txt:
-                continue
+        stripped = [t.strip() for t in data["text"]]
+        mask = np.fromiter((bool(t) for t in stripped), dtype=bool, count=len(stripped))
+        if not mask.any():
+            return [], []
 
-            # Bounding box coordinates: [x_min, y_min, x_max, y_max] normalized to 1000x1000
-            x, y, bw, bh = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
-            bbox = [
-                int(1000 * x / w),
-                int(1000 * y / h),
-                int(1000 * (x + bw) / w),
-                int(1000 * (y + bh) / h),
-            ]
+        # Bounding boxes [x_min, y_min, x_max, y_max] normalized to
+        # 1000x1000, computed in four SIMD integer passes instead of a
+        # Python loop over every detected word
+        x = np.asarray(data["left"], dtype=np.int32)[mask]
+        y = np.asarray(data["top"], dtype=np.int32)[mask]
+        bw = np.asarray(data["width"], dtype=np.int32)[mask]
+        bh = np.asarray(data["height"], dtype=np.int32)[mask]
 
-            words.append(txt)
-            boxes.append(bbox)
+        boxes = np.stack([
+            x * 1000 // w,
+            y * 1000 // h,
+            (x + bw) * 1000 // w,
+            (y + bh) * 1000 // h,
+        ], axis=1).tolist()
+        words = [t for t in stripped if t]
 
         return words, boxes
 
+    @staticmethod
+    def ocr_with_boxes_batch(images: List[Image.Image]) -> List[Tuple[List[str], List[List[int]]]]:
+        """OCR many pages while loading Tesseract only once.
+
+        pytesseract spawns a fresh tesseract process (and reloads the
+        LSTM model) for every call, which dominates wall time on small
+        pages. When tesserocr is installed, one PyTessBaseAPI instance
+        is reused across the whole batch; otherwise each image falls
+        back to the per-image subprocess path.
+        """
+        try:
+            from tesserocr import PyTessBaseAPI, RIL, iterate_level
+        except ImportError:
+            return [LayoutLMv3Engine.ocr_with_boxes(img) for img in images]
+
+        results = []
+        with PyTessBaseAPI() as api:
+            for image in images:
+                api.SetImage(image)
+                api.Recognize()
+
+                words, boxes = [], []
+                w, h = image.size
+                for word in iterate_level(api.GetIterator(), RIL.WORD):
+                    txt = (word.GetUTF8Text(RIL.WORD) or "").strip()
+                    if not txt:
+                        continue
+                    x0, y0, x1, y1 = word.BoundingBox(RIL.WORD)
+                    boxes.append([
+                        int(1000 * x0 / w),
+                        int(1000 * y0 / h),
+                        int(1000 * x1 / w),
+                        int(1000 * y1 / h),
+                    ])
+                    words.append(txt)
+                results.append((words, boxes))
+
+        return results
+
     @staticmethod
     def _same_row(a: List[int], b: List[int], tol: int = 25) -> bool:
         """Check if two boxes are on the same vertical row."""
@@ -82,29 +233,60 @@ class LayoutLMv3Engine:
         """Check if box A is to the right of box B."""
         return a[0] > b[2]
 
+    @staticmethod
+    def _value_right_of(words: List[str], boxes_np: "np.ndarray", anchor: int) -> Optional[str]:
+        """Join up to 8 words on the anchor's row to its right, or None."""
+        label_box = boxes_np[anchor]
+
+        if _candidates_njit is not None:
+            candidates = _candidates_njit(boxes_np, label_box[1], label_box[2], 25)
+        else:
+            # Whole-array comparisons instead of a Python loop over every word
+            same_row = np.abs(boxes_np[:, 1] - label_box[1]) < 25
+            right_of = boxes_np[:, 0] > label_box[2]
+            candidates = np.flatnonzero(same_row & right_of)
+
+        if not candidates.size:
+            return None
+        order = np.argsort(boxes_np[candidates, 0], kind="stable")
+        picked = candidates[order][:8]
+        return " ".join(words[j] for j in picked).strip()
+
     @staticmethod
     def extract_by_layout(words: List[str], boxes: List[List[int]]) -> Dict[str, Any]:
         """Extract fields deterministically using spatial anchoring."""
         results = {k: None for k in FIELD_LABELS}
+        if not words:
+            return results
 
-        for field, labels in FIELD_LABELS.items():
-            for i, word in enumerate(words):
+        # One contiguous int32 array for the vectorized spatial tests;
+        # words lowercased once per document instead of per comparison
+        boxes_np = np.asarray(boxes, dtype=np.int32)
+        words_lower = [w.lower() for w in words]
+
+        if LABEL_AUTOMATON is not None:
+            # Single automaton walk over all words collects every anchor;
+            # word order is preserved so first-match-wins stays the same
+            anchors: Dict[str, List[int]] = {}
+            for i, word in enumerate(words_lower):
+                for _, fields in LABEL_AUTOMATON.iter(word):
+                    for field in fields:
+                        anchors.setdefault(field, []).append(i)
+
+            for field, indices in anchors.items():
+                for i in indices:
+                    value = LayoutLMv3Engine._value_right_of(words, boxes_np, i)
+                    if value:
+                        results[field] = value
+                        break
+            return results
+
+        # Fallback: per-(field, label) substring scan
+        for field, labels in FIELD_LABELS_LOWER.items():
+            for i, word in enumerate(words_lower):
                 for label in labels:
-                    if label.lower() in word.lower():
-                        label_box = boxes[i]
-                        candidates = []
-
-                        # Look for words on the same row, to the right of the label
-                        for j in range(len(words)):
-                            if LayoutLMv3Engine._same_row(boxes[j], label_box) and \
-                               LayoutLMv3Engine._is_right_of(boxes[j], label_box):
-                                candidates.append((boxes[j][0], words[j]))
-
-                        # Sort candidates by x-coordinate and join them
-                        candidates = sorted(candidates, key=lambda x: x[0])
-                        if candidates:
-                            # Heuristic: Take up to 6 words to the right
-                            results[field] = " ".join([c[1] for c in candidates[:8]]).strip()
+                    if label in word:
+                        results[field] = LayoutLMv3Engine._value_right_of(words, boxes_np, i)
                         break
                 if results[field]: break
 
@@ -115,11 +297,27 @@ class LayoutLMv3Engine:
         """Full pipeline for spatial extraction."""
         # words, boxes normalization happens inside ocr_with_boxes
         words, boxes = LayoutLMv3Engine.ocr_with_boxes(image)
-        
+
         # Determine structured fields via layout anchoring
         structured_data = LayoutLMv3Engine.extract_by_layout(words, boxes)
-        
-        # Include full OCR text for redundancy/LLM context
-        structured_data["_raw_ocr"] = " ".join(words)
-        
-        return structured_data
+
+        # "_raw_ocr" joins lazily on first access - layout-only consumers
+        # never pay the O(total chars) join
+        return _LayoutResult(structured_data, words)
+
+    @staticmethod
+    def process_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+        """Process many forms in parallel worker processes.
+
+        With OMP_THREAD_LIMIT=1 each Tesseract run stays on one core, so
+        one worker per core scales throughput roughly linearly instead
+        of cores fighting over Tesseract's own OpenMP threads.
+        """
+        if len(images) <= 1:
+            return [LayoutLMv3Engine.process_image(img) for img in images]
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        max_workers = min(len(images), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(LayoutLMv3Engine.process_image, images))
@@ -0,0 +1,158 @@
+"""
+Disk-backed content-addressable cache for LLM completions.
+A cache hit turns a full Groq round-trip (hundreds of ms plus token
+cost) into one hash and one small file read.
+"""
+import os
+import json
+import time
+import hashlib
+from typing import Any, Optional
+
+# Bump whenever a prompt changes so stale completions invalidate themselves
+PROMPT_VERSION = "v2"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "medscan-llm")
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+
+# Optional semantic cache - catches near-duplicate OCR texts (scanner noise,
+# re-uploads of the same form) that the exact hash misses
+try:
+    import numpy as np
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    SEMANTIC_CACHE_AVAILABLE = True
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+
+
+class SemanticCache:
+    """Embedding-similarity cache for near-duplicate OCR texts.
+
+    Two OCR passes over the same form rarely hash identically, but they
+    embed almost identically. Texts are embedded with MiniLM, searched in
+    a FAISS inner-product index, and anything above the cosine threshold
+    returns the stored extraction without an LLM call. No-ops (get returns
+    None, add does nothing) when the optional deps are missing or the
+    LLM_SEMANTIC_CACHE env toggle is off.
+    """
+
+    def __init__(self, threshold: float = 0.97):
+        self.threshold = threshold
+        self._enabled = None  # resolved lazily, see the enabled property
+        self._embedder = None
+        self._index = None
+        self._results = []
+
+    @property
+    def enabled(self) -> bool:
+        # Read the toggle on first use, not at import: groq_service defers
+        # load_dotenv() until the service is built, so an import-time read
+        # would miss LLM_SEMANTIC_CACHE set in .env
+        if self._enabled is None:
+            self._enabled = (
+                SEMANTIC_CACHE_AVAILABLE
+                and os.getenv("LLM_SEMANTIC_CACHE", "false").lower() == "true"
+            )
+        return self._enabled
+
+    def _ensure_loaded(self):
+        # Model load is ~100MB - defer until the first lookup
+        if self._embedder is None:
+            self._embedder = SentenceTransformer("all-MiniLM-L6-v2")
+            self._index = faiss.IndexFlatIP(self._embedder.get_sentence_embedding_dimension())
+
+    def _embed(self, text: str):
+        return self._embedder.encode([text], normalize_embeddings=True).astype(np.float32)
+
+    def get(self, text: str) -> Optional[Any]:
+        """Return the stored result for the nearest neighbour above threshold."""
+        if not self.enabled:
+            return None
+        self._ensure_loaded()
+        if self._index.ntotal == 0:
+            return None
+        scores, ids = self._index.search(self._embed(text), 1)
+        if scores[0][0] >= self.threshold:
+            return self._results[ids[0][0]]
+        return None
+
+    def add(self, text: str, result: Any):
+        """Index a fresh extraction result under its text embedding."""
+        if not self.enabled:
+            return
+        self._ensure_loaded()
+        self._index.add(self._embed(text))
+        self._results.append(result)
+
+
+class LLMCache:
+    """SHA-256-keyed JSON cache for LLM responses, with TTL."""
+
+    def __init__(self, cache_dir: Optional[str] = None, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self._cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def cache_dir(self) -> str:
+        # Resolved on first use so LLM_CACHE_DIR from .env (loaded lazily
+        # by groq_service) is honoured; set() creates the directory tree
+        if self._cache_dir is None:
+            self._cache_dir = os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR)
+        return self._cache_dir
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, user_prompt: str, temperature: float) -> str:
+        """Canonical request hash: same inputs -> same key across restarts."""
+        req = {
+            "provider": "groq",
+            "model": model,
+            "prompt_version": PROMPT_VERSION,
+            "system": system_prompt,
+            "user": user_prompt,
+            "temperature": temperature,
+        }
+        return hashlib.sha256(json.dumps(req, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        # Two-level fanout so a big cache doesn't become one huge directory
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached response, or None on miss/expiry/corruption."""
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("expires_at") and entry["expires_at"] < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        return entry.get("response")
+
+    def set(self, key: str, value: Any, model: Optional[str] = None):
+        """Store a response; failures are silent (cache is best-effort)."""
+        path = self._path(key)
+        now = time.time()
+        entry = {
+            "response": value,
+            "model": model,
+            "prompt_version": PROMPT_VERSION,
+            "created_at": now,
+            "expires_at": now + self.ttl_seconds,
+        }
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
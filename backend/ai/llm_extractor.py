@@ -1,5 +1,3 @@
-llm_extractor.py:-
-
 """
 LLM-based extraction service for medical documents.
 Converts OCR extracted text into structured JSON format.
@@ -8,19 +6,110 @@ Simplified approach: Direct OCR -> Groq LLM -> Template mapping.
 import re
 import os
 import json
-from typing import Dict, Any, List
+import logging
+from typing import Dict, Any, List, Optional
 from datetime import datetime
 from models.models import PatientRecord, PatientRecordItem, MedicationItem
 
+logger = logging.getLogger(__name__)
+
 try:
     from ai.groq_service import get_groq_service
     GROQ_AVAILABLE = True
 except Exception as e:
     GROQ_AVAILABLE = False
-    print(f"⚠ Groq service not available: {e}")
+    logger.warning("Groq service not available: %s", e)
 
+# Already includes GROQ_AVAILABLE - callers never need to re-check it
 USE_GROQ = os.getenv("USE_GROQ", "true").lower() == "true" and GROQ_AVAILABLE
 
+# google-re2 matches with a DFA (no backtracking blowup on OCR noise);
+# fall back silently when it isn't installed
+try:
+    import re2 as _re2
+except ImportError:
+    _re2 = None
+
+
+def _compile(pattern: str, flags: int = 0):
+    """Compile with RE2 when possible, stdlib re otherwise.
+
+    RE2 rejects lookaheads, so patterns using (?=...) keep the stdlib
+    engine automatically.
+    """
+    if _re2 is not None:
+        try:
+            return _re2.compile(pattern, flags)
+        except Exception:
+            pass
+    return re.compile(pattern, flags)
+
+
+# Extraction patterns, compiled once at import instead of per document.
+# The regex fallback runs whenever Groq is unavailable or errors, so these
+# sit on the per-document hot path.
+_UHID_RE = _compile(r'(?:UHID|Patient ID|ID)[:\s]+([A-Z0-9\-]+)', re.IGNORECASE)
+_NAME_RE = _compile(r'(?:Name|Patient Name)[:\s]+([A-Za-z\s]+)', re.IGNORECASE)
+_DOB_RE = _compile(r'(?:DOB|Date of Birth)[:\s]+([0-9\/\-]+)', re.IGNORECASE)
+_GENDER_RE = _compile(r'(?:Gender|Sex)[:\s]+([MFmf])', re.IGNORECASE)
+_PHONE_RE = _compile(r'(?:Phone|Mobile|Tel)[:\s]+([0-9\s\-\+]+)', re.IGNORECASE)
+_COMPLAINT_RE = _compile(r'(?:Chief Complaint|Complaint)[:\s]+(.*?)(?=\n[A-Z][A-Za-z ]*:|$)', re.IGNORECASE | re.DOTALL)
+_DIAGNOSIS_RE = _compile(r'Diagnosis[:\s]+(.*?)(?=\n[A-Z][A-Za-z ]*:|$)', re.IGNORECASE | re.DOTALL)
+_BP_RE = _compile(r'(?:BP|Blood Pressure)[:\s]*(\d{2,3}/\d{2,3})', re.IGNORECASE)
+_PULSE_RE = _compile(r'(?:Pulse|Heart Rate|HR)[:\s]*(\d{2,3})', re.IGNORECASE)
+_TEMP_RE = _compile(r'(?:Temp|Temperature)[:\s]*([\d.]+)', re.IGNORECASE)
+_WEIGHT_RE = _compile(r'(?:Weight|Wt)[:\s]*([\d.]+\s*kg)', re.IGNORECASE)
+_MED_LINE_RE = _compile(r'^\s*(?:\d+\.\s*)?([A-Za-z]+)\s+(\d+\s*mg)\s*-\s*([A-Z]+)', re.IGNORECASE | re.MULTILINE)
+_TEST_RESULT_RE = _compile(r'^([A-Za-z ()/]+?)[:\s]+([\d.]+)\s*([a-zA-Z/%]+)?\s*$', re.MULTILINE)
+_REMARKS_RE = _compile(r'(?:Remarks|Impression)[:\s]+(.*?)(?=\n[A-Z][A-Za-z ]*:|$)', re.IGNORECASE | re.DOTALL)
+_DATE_RE = _compile(r'Date[:\s]+([0-9\/\-]+)', re.IGNORECASE)
+_DOCTOR_RE = _compile(r'(?:Dr\.?|Doctor)[:\s]*([A-Za-z. ]+)', re.IGNORECASE)
+
+# Values that count as "not filled" wherever extraction output is scored
+_EMPTY_VALUES = frozenset(("", "null", "N/A"))
+
+# Shared blank item - most of the ~35 template fields on a typical document
+# come back empty, so one frozen instance serves them all
+_EMPTY_ITEM = PatientRecordItem(value=None, confidence="HIGH")
+
+# Document-type keywords; first keyword appearing in the text decides
+_DOC_TYPE_KEYWORDS = {
+    "OPD_NOTE": ("opd", "out-patient", "outpatient", "chief complaint"),
+    "LAB_REPORT": ("laboratory", "lab report", "test result", "pathologist"),
+    "PRESCRIPTION": ("prescription", "rx", "medicines prescribed"),
+}
+
+# One Aho-Corasick pass over the text replaces up to 11 separate substring
+# scans; without it, a single compiled alternation does the same in one
+# IGNORECASE pass (no full text.lower() copy either way on that path)
+try:
+    import ahocorasick
+
+    DOC_TYPE_AUTOMATON = ahocorasick.Automaton()
+    for _doc_type, _keywords in _DOC_TYPE_KEYWORDS.items():
+        for _keyword in _keywords:
+            DOC_TYPE_AUTOMATON.add_word(_keyword, _doc_type)
+    DOC_TYPE_AUTOMATON.make_automaton()
+except ImportError:
+    DOC_TYPE_AUTOMATON = None
+
+# Named groups map straight to the doc-type labels via match.lastgroup
+_DOCTYPE_RE = _compile(
+    r"(?P<OPD_NOTE>opd|out-?patient|chief complaint)"
+    r"|(?P<LAB_REPORT>laboratory|lab report|test result|pathologist)"
+    r"|(?P<PRESCRIPTION>prescription|rx|medicines prescribed)",
+    re.IGNORECASE,
+)
+
+# (field, pattern) pairs for the generic fallback pass; patient_id goes
+# through _extract_uhid instead
+_FALLBACK_FIELDS = (
+    ('patient_name', _NAME_RE),
+    ('date_of_birth', _DOB_RE),
+    ('gender', _GENDER_RE),
+    ('phone', _PHONE_RE),
+)
+
 class LLMExtractor:
     """LLM-powered extraction service that maps OCR text to structured JSON."""
     
@@ -30,156 +119,248 @@ class LLMExtractor:
         Extract structured data from OCR text using Groq LLM.
         Simple pipeline: OCR Text → Groq LLM → Structured Data
         """
-        should_use_groq = use_groq if use_groq is not None else USE_GROQ
+        # USE_GROQ already folds in availability; an explicit override still
+        # has to respect it (the service may have failed to import)
+        should_use_groq = USE_GROQ if use_groq is None else (use_groq and GROQ_AVAILABLE)
         
         if document_type == "AUTO":
             document_type = LLMExtractor._detect_document_type(ocr_text)
         
-        if should_use_groq and GROQ_AVAILABLE:
+        if should_use_groq:
             try:
-                print("🤖 Using Groq LLM for direct extraction...")
+                logger.debug("Using Groq LLM for direct extraction")
                 groq_service = get_groq_service()
-                
+
                 # Single-step extraction: OCR text → Complete template
+                # (transient 429/5xx retries happen inside the service,
+                # right around the API calls)
                 extracted_data = groq_service.extract_full_template(ocr_text)
-                
+
                 if "error" in extracted_data:
-                    print(f"⚠️ Groq error, falling back to basic extraction: {extracted_data['error']}")
+                    logger.warning("Groq error, falling back to basic extraction: %s", extracted_data['error'])
                     return LLMExtractor._fallback_extraction(ocr_text, document_type)
-                
+
                 return extracted_data
-                
+
             except Exception as e:
-                print(f"\n❌ Groq extraction failed: {type(e)._name_}: {e}")
-                print(f"🔄 Falling back to regex extraction")
+                logger.warning("Groq extraction failed (%s: %s), falling back to regex extraction", type(e).__name__, e)
                 # Fallback to regex extraction
-        
+
         # Route to appropriate regex-based extractor (original method)
-        print(f"\n🔧 Using REGEX extraction method for {document_type}")
+        logger.debug("Using regex extraction for %s", document_type)
         if document_type == "OPD_NOTE":
-            result = LLMExtractor._extract_opd_note(ocr_text)
+            return LLMExtractor._extract_opd_note(ocr_text)
         elif document_type == "LAB_REPORT":
-            result = LLMExtractor._extract_lab_report(ocr_text)
+            return LLMExtractor._extract_lab_report(ocr_text)
         elif document_type == "PRESCRIPTION":
-            result = LLMExtractor._extract_prescription(ocr_text)
+            return LLMExtractor._extract_prescription(ocr_text)
         else:
-            print("ℹ️ Groq not available, using fallback extraction")
             return LLMExtractor._fallback_extraction(ocr_text, document_type)
-    
+
+    @staticmethod
+    def warmup() -> None:
+        """Build the Groq client eagerly so the first upload skips cold-start."""
+        if USE_GROQ:
+            try:
+                get_groq_service()
+            except Exception as e:
+                logger.warning("Groq warmup failed: %s", e)
+
+    @staticmethod
+    def extract_structured_data_batch(ocr_texts: List[str], document_type: str = "AUTO") -> List[Dict[str, Any]]:
+        """
+        Extract structured data for several documents at once.
+        Packs multiple OCR texts into each Groq request, so a folder of
+        scans costs a handful of API round-trips instead of one per file.
+        """
+        if not ocr_texts:
+            return []
+
+        if USE_GROQ:
+            try:
+                logger.debug("Using Groq LLM for batch extraction of %d documents", len(ocr_texts))
+                return get_groq_service().extract_full_template_multi(ocr_texts)
+            except Exception as e:
+                logger.warning("Groq batch extraction failed (%s: %s), falling back to per-document extraction", type(e).__name__, e)
+
+        return [
+            LLMExtractor.extract_structured_data(ocr_text, document_type, use_groq=False)
+            for ocr_text in ocr_texts
+        ]
+
+    @staticmethod
+    def _extract_uhid(ocr_text: str) -> Optional[str]:
+        """Shared UHID/patient-id lookup; None when no label is found."""
+        # Fast path: the common exact "UHID: X" spelling is a find + slice,
+        # no regex engine involved
+        idx = ocr_text.find("UHID")
+        if idx >= 0:
+            n = len(ocr_text)
+            j = idx + 4
+            while j < n and ocr_text[j] in ": \t":
+                j += 1
+            if j > idx + 4:  # at least one separator, like the pattern requires
+                end = j
+                # _UHID_RE is IGNORECASE, so its [A-Z0-9-] class accepts
+                # lowercase too - the scan must as well or mixed-case ids
+                # like "Hosp-2025-001" get truncated
+                while end < n and (ocr_text[end].isascii() and (ocr_text[end].isalnum() or ocr_text[end] == "-")):
+                    end += 1
+                if end > j:
+                    return ocr_text[j:end]
+        # Regex covers case variants and the Patient ID / ID labels
+        match = _UHID_RE.search(ocr_text)
+        return match.group(1) if match else None
+
     @staticmethod
     def _fallback_extraction(ocr_text: str, document_type: str) -> Dict[str, Any]:
         """Simple regex-based fallback extraction."""
         extracted = {}
-        
-        # Extract common fields using regex
-        uhid_match = re.search(r'(?:UHID|Patient ID|ID)[:\s]+([A-Z0-9\-]+)', ocr_text, re.IGNORECASE)
-        if uhid_match:
-            extracted['patient_id'] = uhid_match.group(1)
-        
-        name_match = re.search(r'(?:Name|Patient Name)[:\s]+([A-Za-z\s]+)', ocr_text, re.IGNORECASE)
-        if name_match:
-            extracted['patient_name'] = name_match.group(1).strip()
-        
-        dob_match = re.search(r'(?:DOB|Date of Birth)[:\s]+([0-9\/\-]+)', ocr_text, re.IGNORECASE)
-        if dob_match:
-            extracted['date_of_birth'] = dob_match.group(1)
-        
-        gender_match = re.search(r'(?:Gender|Sex)[:\s]+([MFmf])', ocr_text, re.IGNORECASE)
-        if gender_match:
-            extracted['gender'] = gender_match.group(1).upper()
-        
-        phone_match = re.search(r'(?:Phone|Mobile|Tel)[:\s]+([0-9\s\-\+]+)', ocr_text, re.IGNORECASE)
-        if phone_match:
-            extracted['phone'] = phone_match.group(1).strip()
-        
+
+        uhid = LLMExtractor._extract_uhid(ocr_text)
+        if uhid:
+            extracted['patient_id'] = uhid
+
+        for field, pattern in _FALLBACK_FIELDS:
+            match = pattern.search(ocr_text)
+            if match:
+                extracted[field] = match.group(1).strip()
+
+        if 'gender' in extracted:
+            extracted['gender'] = extracted['gender'].upper()
+
         return extracted
-    
+
+    @staticmethod
+    def _extract_opd_note(ocr_text: str) -> Dict[str, Any]:
+        """Regex extraction for OPD notes: complaint, vitals, diagnosis, medications."""
+        extracted = LLMExtractor._fallback_extraction(ocr_text, "OPD_NOTE")
+
+        for field, pattern in (
+            ('chief_complaint', _COMPLAINT_RE),
+            ('diagnosis', _DIAGNOSIS_RE),
+            ('blood_pressure', _BP_RE),
+            ('pulse', _PULSE_RE),
+            ('temperature', _TEMP_RE),
+            ('weight', _WEIGHT_RE),
+        ):
+            match = pattern.search(ocr_text)
+            if match:
+                extracted[field] = match.group(1).strip()
+
+        medications = LLMExtractor._extract_medications(ocr_text)
+        if medications:
+            extracted['medications'] = medications
+
+        return extracted
+
+    @staticmethod
+    def _extract_medications(ocr_text: str) -> List[Dict[str, str]]:
+        """Medication lines ("1. Amoxicillin 500 mg - TID") in one scan."""
+        return [
+            {'name': m.group(1), 'dose': m.group(2), 'frequency': m.group(3)}
+            for m in _MED_LINE_RE.finditer(ocr_text)
+        ]
+
+    @staticmethod
+    def _extract_lab_report(ocr_text: str) -> Dict[str, Any]:
+        """Regex extraction for lab reports: report date, test rows, remarks."""
+        extracted = LLMExtractor._fallback_extraction(ocr_text, "LAB_REPORT")
+
+        date_match = _DATE_RE.search(ocr_text)
+        if date_match:
+            extracted['visit_date'] = date_match.group(1)
+
+        results = []
+        for test_match in _TEST_RESULT_RE.finditer(ocr_text):
+            results.append({
+                'test': test_match.group(1).strip(),
+                'value': test_match.group(2),
+                'unit': test_match.group(3) or ''
+            })
+        if results:
+            extracted['test_results'] = results
+
+        remarks_match = _REMARKS_RE.search(ocr_text)
+        if remarks_match:
+            extracted['comments'] = remarks_match.group(1).strip()
+
+        return extracted
+
+    @staticmethod
+    def _extract_prescription(ocr_text: str) -> Dict[str, Any]:
+        """Regex extraction for prescriptions: doctor and medication lines."""
+        extracted = LLMExtractor._fallback_extraction(ocr_text, "PRESCRIPTION")
+
+        doctor_match = _DOCTOR_RE.search(ocr_text)
+        if doctor_match:
+            extracted['doctor_name'] = doctor_match.group(1).strip()
+
+        medications = LLMExtractor._extract_medications(ocr_text)
+        if medications:
+            extracted['medications'] = medications
+
+        return extracted
+
+    # Template fields filled straight from extracted_data; visit_date gets
+    # special-cased below (falls back to appointment_datetime)
+    _PATIENT_FIELDS = (
+        # Patient Info
+        "patient_id", "patient_name", "surname", "age", "gender",
+        "date_of_birth", "phone", "mobile", "email", "address",
+        "suburb", "state", "occupation",
+        # Hospital Info
+        "hospital_name", "hospital_address",
+        # Insurance/Subscriber
+        "insurance_id", "insurance_type", "group_number", "subscriber_name",
+        "medicare_no", "medicare_ref", "health_fund", "health_fund_no",
+        "vet_affairs",
+        # Visit/Medical
+        "visit_date", "procedure", "doctor_name", "gp_name", "referrer",
+        "chief_complaint", "comments",
+        # Clinical/Vitals
+        "blood_pressure", "pulse", "temperature", "weight", "spo2",
+        "diagnosis",
+    )
+
     @staticmethod
     def match_to_patient_record(extracted_data: Dict[str, Any]) -> PatientRecord:
         """
         Match extracted data to the standardized PatientRecord template.
         NO confidence filtering - all fields are populated with HIGH confidence.
         """
-        
+
         def get_val(field_name: str) -> PatientRecordItem:
             """Extract value and set confidence to HIGH for all fields."""
             value = extracted_data.get(field_name)
-            
+
             # Handle nested dict structure (if present from old extraction)
             if isinstance(value, dict):
                 value = value.get("value")
-            
-            # Convert to string if present, otherwise None
-            if value is not None and value != "" and value != "null" and value != "N/A":
-                return PatientRecordItem(value=str(value), confidence="HIGH")
-            else:
-                return PatientRecordItem(value=None, confidence="HIGH")
+
+            # Convert to string if present, otherwise the shared empty item
+            if value is None or (isinstance(value, str) and value in _EMPTY_VALUES):
+                return _EMPTY_ITEM
+            return PatientRecordItem(value=str(value), confidence="HIGH")
 
         # Build comprehensive record - ALL fields get HIGH confidence
-        return PatientRecord(
-            # Patient Info
-            patient_id=get_val("patient_id"),
-            patient_name=get_val("patient_name"),
-            surname=get_val("surname"),
-            age=get_val("age"),
-            gender=get_val("gender"),
-            date_of_birth=get_val("date_of_birth"),
-            phone=get_val("phone"),
-            mobile=get_val("mobile"),
-            email=get_val("email"),
-            address=get_val("address"),
-            suburb=get_val("suburb"),
-            state=get_val("state"),
-            occupation=get_val("occupation"),
-            
-            # Hospital Info
-            hospital_name=get_val("hospital_name"),
-            hospital_address=get_val("hospital_address"),
-            
-            # Insurance/Subscriber
-            insurance_id=get_val("insurance_id"),
-            insurance_type=get_val("insurance_type"),
-            group_number=get_val("group_number"),
-            subscriber_name=get_val("subscriber_name"),
-            medicare_no=get_val("medicare_no"),
-            medicare_ref=get_val("medicare_ref"),
-            health_fund=get_val("health_fund"),
-            health_fund_no=get_val("health_fund_no"),
-            vet_affairs=get_val("vet_affairs"),
-            
-            # Visit/Medical
-            visit_date=get_val("visit_date") if "visit_date" in extracted_data else get_val("appointment_datetime"),
-            procedure=get_val("procedure"),
-            doctor_name=get_val("doctor_name"),
-            gp_name=get_val("gp_name"),
-            referrer=get_val("referrer"),
-            chief_complaint=get_val("chief_complaint"),
-            comments=get_val("comments"),
-            
-            # Clinical/Vitals
-            blood_pressure=get_val("blood_pressure"),
-            pulse=get_val("pulse"),
-            temperature=get_val("temperature"),
-            weight=get_val("weight"),
-            spo2=get_val("spo2"),
-            diagnosis=get_val("diagnosis"),
-            
-            # Metadata
-            medications=[],
-            status="VERIFIED"
-        )
+        kwargs = {field: get_val(field) for field in LLMExtractor._PATIENT_FIELDS}
+        if "visit_date" not in extracted_data:
+            kwargs["visit_date"] = get_val("appointment_datetime")
+        kwargs["medications"] = []
+        kwargs["status"] = "VERIFIED"
+        return PatientRecord(**kwargs)
     
     @staticmethod
     def _detect_document_type(text: str) -> str:
         """Auto-detect document type from OCR text."""
-        text_lower = text.lower()
-        if any(keyword in text_lower for keyword in ["opd", "out-patient", "outpatient", "chief complaint"]):
-            return "OPD_NOTE"
-        elif any(keyword in text_lower for keyword in ["laboratory", "lab report", "test result", "pathologist"]):
-            return "LAB_REPORT"
-        elif any(keyword in text_lower for keyword in ["prescription", "rx", "medicines prescribed"]):
-            return "PRESCRIPTION"
-        return "GENERAL"
+        if DOC_TYPE_AUTOMATON is not None:
+            # Single linear scan; the first keyword hit decides the type
+            for _, doc_type in DOC_TYPE_AUTOMATON.iter(text.lower()):
+                return doc_type
+            return "GENERAL"
+        match = _DOCTYPE_RE.search(text)
+        return match.lastgroup if match else "GENERAL"
     
     @staticmethod
     def calculate_confidence(extracted_data: Dict[str, Any], document_type: str) -> float:
@@ -189,15 +370,18 @@ class LLMExtractor:
         """
         if not extracted_data:
             return 0.0
-            
-        filled = sum(1 for v in extracted_data.values() if v not in [None, "", "null", "N/A"])
-        total = len(extracted_data)
-        
-        if total == 0:
-            return 0.0
-            
-        score = round(filled / total, 2)
-        return score
+
+        # Single pass; frozenset membership is a C-level hash lookup, and
+        # non-string values (e.g. medications lists) always count as filled
+        filled = 0
+        for value in extracted_data.values():
+            if isinstance(value, dict):
+                # Nested {"value": ..., "confidence": ...} items - judge by
+                # the inner value, not the (always truthy) wrapper dict
+                value = value.get('value')
+            if value is not None and (not isinstance(value, str) or value not in _EMPTY_VALUES):
+                filled += 1
+        return round(filled / len(extracted_data), 2)
     
     @staticmethod
     def determine_status(confidence: float) -> str:
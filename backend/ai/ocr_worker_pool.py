@@ -0,0 +1,97 @@
+"""
+Persistent OCR worker pool.
+
+Each worker process loads the TrOCR model once and then serves pages from
+a shared queue, so model load cost is paid per worker instead of per page
+and CPU preprocessing overlaps GPU generation across workers. Pool size
+comes from OCR_WORKERS (default 1); each worker can be pinned to its own
+GPU via CUDA_VISIBLE_DEVICES round-robin when several are present.
+"""
+import os
+import multiprocessing as mp
+from typing import Optional
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "1"))
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+
+
+def _worker_loop(worker_id: int, task_queue: mp.Queue, result_queue: mp.Queue, gpu_id: Optional[int]):
+    """Worker process: load the model once, then OCR pages until sentinel."""
+    if gpu_id is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+
+    from ai.ai_engine import ocr_page_improved, _load_model
+
+    print(f"[OCR-POOL] Worker {worker_id} loading model...")
+    _load_model()
+    print(f"[OCR-POOL] Worker {worker_id} ready")
+
+    while True:
+        task = task_queue.get()
+        if task is None:  # Sentinel: graceful shutdown
+            print(f"[OCR-POOL] Worker {worker_id} shutting down")
+            break
+
+        page_id, pil_image = task
+        try:
+            result = ocr_page_improved(pil_image, batch_size=OCR_BATCH_SIZE)
+            result_queue.put((page_id, result, None))
+        except Exception as e:
+            result_queue.put((page_id, None, str(e)))
+
+
+class OCRWorkerPool:
+    """Small pool of persistent OCR processes fed through a queue."""
+
+    def __init__(self, num_workers: int = OCR_WORKERS):
+        self.num_workers = num_workers
+        self.task_queue = mp.Queue()
+        self.result_queue = mp.Queue()
+        self.workers = []
+
+    def start(self):
+        """Spawn the worker processes (each loads its own model)."""
+        try:
+            import torch
+            gpu_count = torch.cuda.device_count()
+        except ImportError:
+            gpu_count = 0
+
+        for i in range(self.num_workers):
+            gpu_id = i % gpu_count if gpu_count > 0 else None
+            p = mp.Process(
+                target=_worker_loop,
+                args=(i, self.task_queue, self.result_queue, gpu_id),
+                daemon=True,
+            )
+            p.start()
+            self.workers.append(p)
+        print(f"[OCR-POOL] Started {self.num_workers} worker(s)")
+
+    def submit(self, page_id, pil_image):
+        """Queue a page for OCR."""
+        self.task_queue.put((page_id, pil_image))
+
+    def get_result(self, timeout: Optional[float] = None):
+        """Return one (page_id, result, error) tuple as it completes."""
+        return self.result_queue.get(timeout=timeout)
+
+    def shutdown(self):
+        """Send one sentinel per worker and wait for them to exit."""
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for p in self.workers:
+            p.join()
+        self.workers = []
+
+
+# Module-level pool, created on demand (same lazy pattern as the model)
+_pool = None
+
+def get_ocr_pool() -> OCRWorkerPool:
+    """Get or create the shared OCR worker pool."""
+    global _pool
+    if _pool is None:
+        _pool = OCRWorkerPool()
+        _pool.start()
+    return _pool
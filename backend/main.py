@@ -91,6 +91,12 @@ app.add_middleware(
 # Mount static directory for the web interface
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+
+@app.on_event("startup")
+def warmup_services():
+    """Build the Groq client once at boot so the first request doesn't pay init cost."""
+    LLMExtractor.warmup()
+
 # ================================================================
 # HELPER FUNCTIONS
 # ================================================================
@@ -47,3 +47,81 @@ class MedicalRecord(BaseModel):
 
     class Config:
         extra = "ignore"
+
+
+class MedicationItem(BaseModel):
+    name: Optional[str] = None
+    dose: Optional[str] = None
+    frequency: Optional[str] = None
+
+    class Config:
+        extra = "ignore"
+
+
+class PatientRecordItem(BaseModel):
+    value: Optional[str] = None
+    confidence: str = "HIGH"
+
+    class Config:
+        extra = "ignore"
+        # Items are write-once; freezing them lets callers share instances,
+        # and skipping copy-on-validation stops pydantic cloning every item
+        # again when it is assigned into a PatientRecord
+        allow_mutation = False
+        copy_on_model_validation = False
+
+
+class PatientRecord(BaseModel):
+    # Patient Info
+    patient_id: PatientRecordItem
+    patient_name: PatientRecordItem
+    surname: PatientRecordItem
+    age: PatientRecordItem
+    gender: PatientRecordItem
+    date_of_birth: PatientRecordItem
+    phone: PatientRecordItem
+    mobile: PatientRecordItem
+    email: PatientRecordItem
+    address: PatientRecordItem
+    suburb: PatientRecordItem
+    state: PatientRecordItem
+    occupation: PatientRecordItem
+
+    # Hospital Info
+    hospital_name: PatientRecordItem
+    hospital_address: PatientRecordItem
+
+    # Insurance/Subscriber
+    insurance_id: PatientRecordItem
+    insurance_type: PatientRecordItem
+    group_number: PatientRecordItem
+    subscriber_name: PatientRecordItem
+    medicare_no: PatientRecordItem
+    medicare_ref: PatientRecordItem
+    health_fund: PatientRecordItem
+    health_fund_no: PatientRecordItem
+    vet_affairs: PatientRecordItem
+
+    # Visit/Medical
+    visit_date: PatientRecordItem
+    procedure: PatientRecordItem
+    doctor_name: PatientRecordItem
+    gp_name: PatientRecordItem
+    referrer: PatientRecordItem
+    chief_complaint: PatientRecordItem
+    comments: PatientRecordItem
+
+    # Clinical/Vitals
+    blood_pressure: PatientRecordItem
+    pulse: PatientRecordItem
+    temperature: PatientRecordItem
+    weight: PatientRecordItem
+    spo2: PatientRecordItem
+    diagnosis: PatientRecordItem
+
+    # Metadata
+    medications: List[MedicationItem] = []
+    status: str = "VERIFIED"
+
+    class Config:
+        extra = "ignore"